@@ -0,0 +1,295 @@
+"""
+Benchmark render thẻ cử tri, chạy không cần giao diện (Linux server / CI).
+
+Tự sinh dữ liệu giả (danh sách cử tri tên tiếng Việt + số CCCD, phôi, folder chữ ký) trong --workdir,
+rồi đo cho từng cỡ danh sách:
+    - nạp danh sách (lần đầu / đã có cache dạng cột), chuẩn bị danh sách ảo, ảnh xem trước
+    - từng thẻ: thẻ/giây, độ trễ p50/p99, chia theo bước (phôi, font, vẽ chữ, chữ ký, dán, encode)
+    - cả đợt ra 1 file PDF với --workers process
+    - RSS đỉnh (process chính và process con)
+
+    python benchmark.py                         # 1k, 10k, 100k dòng
+    python benchmark.py --rows 1000 --cards 200 --json bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from PIL import Image, ImageDraw
+
+from card_cache import CardCache
+from data_loader import SHEET_CACHE
+from pdf_output import encode_jpeg
+from profiling import PROFILER
+from render_engine import CONFIG_FILE, FONT_CACHE, SIGNATURE_CACHE, PreviewPyramid, RenderEngine, get_font_path
+
+HO = ["Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Huỳnh", "Phan", "Vũ", "Võ", "Đặng", "Bùi", "Đỗ", "Hồ", "Ngô", "Dương", "Lý"]
+DEM = ["Văn", "Thị", "Hữu", "Đức", "Minh", "Thanh", "Ngọc", "Quốc", "Thu", "Xuân", "Hoài", "Bảo", "Gia", "Khánh"]
+TEN = ["An", "Bình", "Châu", "Dũng", "Giang", "Hà", "Hải", "Hạnh", "Hùng", "Hương", "Khoa", "Lan", "Linh", "Long",
+       "Mai", "Nam", "Nga", "Ngân", "Nhung", "Phúc", "Phương", "Quân", "Sơn", "Tâm", "Thảo", "Trang", "Tuấn", "Yến"]
+THON = ["Thôn Đông", "Thôn Tây", "Thôn Nam", "Thôn Bắc", "Tổ 1", "Tổ 2", "Tổ 3", "Khu phố Mới"]
+TINH = ["001", "030", "036", "038", "040", "048", "079", "092"]  # mã tỉnh đầu số CCCD
+
+TEMPLATE_SIZE = (800, 760)
+# File cấu hình của repo (tìm theo vị trí benchmark.py, chạy từ thư mục nào cũng được)
+REPO_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), CONFIG_FILE)
+
+
+# ========================================================================================
+# DỮ LIỆU GIẢ
+# ========================================================================================
+def make_sheet(path, rows, seed=0):
+    """Danh sách cử tri giả, đủ các cột như file cấu hình mặc định."""
+    rng = np.random.default_rng(seed)
+    pick = lambda values: np.asarray(values, dtype=object)[rng.integers(0, len(values), rows)]
+    gender = pick(["Nam", "Nữ"])
+    dem = np.where(gender == "Nữ", "Thị", pick(DEM))
+    names = pd.Series(pick(HO)) + " " + pd.Series(dem) + " " + pd.Series(pick(TEN))
+    birth = pd.Timestamp("1940-01-01") + pd.to_timedelta(rng.integers(0, 365 * 66, rows), unit="D")
+    cccd = pd.Series(pick(TINH)) + pd.Series(rng.integers(0, 10**9, rows)).map("{:09d}".format)
+    area = pick(THON)
+
+    df = pd.DataFrame({
+        "Stt": np.arange(1, rows + 1),
+        "Tên đơn vị": "UBND xã Hòa Bình",
+        "Họ tên": names,
+        "Ngày sinh": birth,
+        "Giới tính": gender,
+        "Nơi cư trú": pd.Series(area) + ", xã Hòa Bình",
+        "Số cccd": cccd,
+        "Số thẻ cử tri": np.arange(1, rows + 1),
+        "Khu vực bỏ phiếu": pd.Series(area).map(lambda a: f"KV {THON.index(a) + 1}"),
+        "Thành phố": "Hà Nội",
+        "Người ký": "Trần Văn Bình",
+        "Xã/phường/đặc khu": "Hòa Bình",
+    })
+    if path.endswith(".xlsx"):
+        df.to_excel(path, index=False)
+    else:
+        df.to_csv(path, index=False, encoding="utf-8-sig")
+    return df
+
+
+def make_template(path):
+    img = Image.new("RGB", TEMPLATE_SIZE, (250, 246, 235))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([10, 10, TEMPLATE_SIZE[0] - 10, TEMPLATE_SIZE[1] - 10], outline=(180, 30, 30), width=6)
+    for y in range(300, 560, 25):
+        draw.line([(40, y + 12), (TEMPLATE_SIZE[0] - 40, y + 12)], fill=(200, 200, 200))
+    img.save(path, quality=92)
+
+
+def make_signatures(folder, cccds, count, seed=0):
+    """count ảnh chữ ký PNG (nền trong suốt) đặt tên theo CCCD - vài mẫu, ghi lặp lại bytes cho nhanh."""
+    os.makedirs(folder, exist_ok=True)
+    rnd = random.Random(seed)
+    samples = []
+    for _ in range(8):
+        sig = Image.new("RGBA", (300, 130), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(sig)
+        pts = [(20 + i * 26, 65 + rnd.randint(-45, 45)) for i in range(11)]
+        draw.line(pts, fill=(20, 30, 120, 255), width=5, joint="curve")
+        path = os.path.join(folder, ".sample.png")
+        sig.save(path)
+        with open(path, "rb") as f:
+            samples.append(f.read())
+        os.remove(path)
+    for i, cccd in enumerate(rnd.sample(list(cccds), min(count, len(cccds)))):
+        with open(os.path.join(folder, f"{cccd}.png"), "wb") as f:
+            f.write(samples[i % len(samples)])
+
+
+def make_config(path, source=REPO_CONFIG):
+    """Cấu hình chung lấy từ file cấu hình của repo (bỏ phần chỉnh riêng)."""
+    with open(source, "r", encoding="utf-8") as f:
+        global_config = json.load(f).get("global", {})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"global": global_config, "custom": {}}, f, ensure_ascii=False)
+
+
+def prepare_dataset(workdir, rows, fmt="csv", signatures=2000):
+    base = os.path.join(workdir, f"voters_{rows}")
+    sheet = f"{base}.{fmt}"
+    sig_dir = f"{base}_sig"
+    if not os.path.exists(sheet):
+        df = make_sheet(sheet, rows)
+        shutil.rmtree(sig_dir, ignore_errors=True)
+        make_signatures(sig_dir, df["Số cccd"], signatures)
+    template = os.path.join(workdir, "template.jpg")
+    if not os.path.exists(template):
+        make_template(template)
+    config = os.path.join(workdir, "config.json")
+    if not os.path.exists(config):
+        make_config(config)
+    return sheet, template, config, sig_dir
+
+
+# ========================================================================================
+# ĐO
+# ========================================================================================
+def percentile(values, q):
+    return float(np.percentile(values, q) * 1000) if values else 0.0
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / (1024 * 1024) if platform.system() == "Darwin" else rss / 1024
+
+
+def load_engine(sheet, template, config, sig_dir):
+    engine = RenderEngine(config_path=config)
+    engine.card_cache = CardCache(max_bytes=0)  # đo render thật, không đọc thẻ đã cache
+    engine.load_config_file()
+    engine.load_excel(sheet)
+    engine.set_template(template)
+    engine.set_signature_folder(sig_dir)
+    return engine
+
+
+def bench_size(workdir, rows, cards, batch, workers, fmt, signatures):
+    result = {"rows": rows}
+    sheet, template, config, sig_dir = prepare_dataset(workdir, rows, fmt, signatures)
+    FONT_CACHE.clear()
+    SIGNATURE_CACHE.clear()
+    get_font_path.cache_clear()
+
+    # --- Nạp danh sách: lần đầu (parse + dựng cache dạng cột) và lần sau (đọc cache) ---
+    shutil.rmtree(SHEET_CACHE.cache_dir, ignore_errors=True)
+    SHEET_CACHE._index, SHEET_CACHE._last = None, (None, None)
+    t0 = time.perf_counter()
+    load_engine(sheet, template, config, sig_dir)
+    result["sheet_load_cold_ms"] = (time.perf_counter() - t0) * 1000
+    SHEET_CACHE._last = (None, None)
+    t0 = time.perf_counter()
+    engine = load_engine(sheet, template, config, sig_dir)
+    result["sheet_load_warm_ms"] = (time.perf_counter() - t0) * 1000
+
+    # --- Danh sách ảo (phần dữ liệu của populate_treeview) ---
+    t0 = time.perf_counter()
+    columns = [engine.display_column(engine.role_column(r)) for r in ("name", "gender", "cccd", "area")]
+    [(i + 1,) + tuple(col[i] if col else "" for col in columns) for i in range(min(rows, 40))]
+    result["list_prep_ms"] = (time.perf_counter() - t0) * 1000
+
+    # --- Xem trước (phần không cần Tk của render_canvas: ảnh nền + trạng thái overlay) ---
+    pyramid = PreviewPyramid()
+    master = engine.template_cache.master(template)
+    t0 = time.perf_counter()
+    for zoom in (1.0, 1.1, 1.2, 1.3, 1.2, 1.1, 1.0):
+        size = (int(TEMPLATE_SIZE[0] * 0.9 * zoom), int(TEMPLATE_SIZE[1] * 0.9 * zoom))
+        pyramid.get(master, size, fast=True)
+        for spec in engine.get_layout(0):
+            if spec.kind == "text": engine.display_value(0, spec.name, spec.upper)
+            else: engine.get_signature_path(0)
+    result["preview_ms"] = (time.perf_counter() - t0) * 1000 / 7
+
+    # --- Từng thẻ, 1 process, chia theo bước (các stage của PROFILER trong pipeline) ---
+    latencies = []
+    sample = list(range(min(cards, rows)))
+    PROFILER.enable()
+    PROFILER.reset()
+    try:
+        for idx in sample:
+            t0 = time.perf_counter()
+            img = engine._draw_card(idx)
+            with PROFILER.stage("encode"):
+                encode_jpeg(img)
+            latencies.append(time.perf_counter() - t0)
+        profile = PROFILER.snapshot()
+    finally:
+        PROFILER.disable()
+    total = sum(latencies)
+    result.update({
+        "cards": len(sample),
+        "cards_per_s": len(sample) / total if total else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "stages": profile["stages"],
+        "caches": profile["caches"],
+    })
+
+    # --- Cả đợt ra 1 file PDF ---
+    batch_rows = list(range(min(batch, rows)))
+    out = os.path.join(workdir, "out", f"batch_{rows}.pdf")
+    t0 = time.perf_counter()
+    engine.render_to_pdf(batch_rows, out, workers=workers)
+    elapsed = time.perf_counter() - t0
+    result.update({
+        "batch_cards": len(batch_rows),
+        "batch_workers": workers,
+        "batch_cards_per_s": len(batch_rows) / elapsed if elapsed else 0.0,
+        "batch_mb": os.path.getsize(out) / (1024 * 1024),
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_children_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+    })
+    os.remove(out)
+    return result
+
+
+# ========================================================================================
+# BÁO CÁO
+# ========================================================================================
+def print_report(results, out=sys.stdout):
+    cols = [("rows", "dòng", "{:>8}"), ("sheet_load_cold_ms", "nạp(ms)", "{:>9.0f}"),
+            ("sheet_load_warm_ms", "cache(ms)", "{:>9.0f}"), ("list_prep_ms", "ds(ms)", "{:>7.1f}"),
+            ("preview_ms", "xem(ms)", "{:>7.1f}"), ("cards_per_s", "thẻ/s", "{:>7.1f}"),
+            ("p50_ms", "p50(ms)", "{:>7.1f}"), ("p99_ms", "p99(ms)", "{:>7.1f}"),
+            ("batch_cards_per_s", "đợt thẻ/s", "{:>9.1f}"), ("peak_rss_mb", "RSS(MB)", "{:>8.0f}"),
+            ("peak_rss_children_mb", "con(MB)", "{:>8.0f}")]
+    print(" ".join(f"{title:>{len(fmt.format(0))}}" for _, title, fmt in cols), file=out)
+    for r in results:
+        print(" ".join(fmt.format(r[key]) for key, _, fmt in cols), file=out)
+
+    for r in results:
+        print(f"\nTừng bước - {r['rows']} dòng, {r['cards']} thẻ "
+              f"(các bước khác nằm trong card; % tính trên card + encode):", file=out)
+        card_ms = sum(r["stages"][k]["total_ms"] for k in ("card", "encode") if k in r["stages"])
+        for name, s in sorted(r["stages"].items(), key=lambda kv: -kv[1]["total_ms"]):
+            share = 100 * s["total_ms"] / card_ms if card_ms else 0
+            print(f"  {name:<16} {s['total_ms']:>9.1f} ms {s['calls']:>8} lần "
+                  f"{s['total_ms'] / max(1, r['cards']):>7.3f} ms/thẻ {share:>5.1f}%", file=out)
+        for name, c in sorted(r["caches"].items()):
+            if c["hit_rate"] is not None:
+                print(f"  cache {name:<10} trúng {c['hit_rate']:.1%}", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark render thẻ cử tri (không cần giao diện).")
+    parser.add_argument("--rows", default="1000,10000,100000", help="Các cỡ danh sách, cách nhau dấu phẩy")
+    parser.add_argument("--cards", type=int, default=500, help="Số thẻ đo từng thẻ (độ trễ, chia bước)")
+    parser.add_argument("--batch", type=int, default=1000, help="Số thẻ đo cả đợt ra PDF")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Số process khi đo cả đợt")
+    parser.add_argument("--format", choices=["csv", "xlsx"], default="csv", help="Định dạng danh sách giả")
+    parser.add_argument("--signatures", type=int, default=2000, help="Số ảnh chữ ký giả mỗi cỡ danh sách")
+    parser.add_argument("--workdir", default=os.path.join(".cache", "bench"), help="Nơi để dữ liệu giả")
+    parser.add_argument("--json", default=None, help="Ghi kết quả ra file JSON")
+    args = parser.parse_args(argv)
+
+    workdir = os.path.abspath(args.workdir)
+    os.makedirs(workdir, exist_ok=True)
+    # Cache danh sách (.cache/sheets) của benchmark nằm riêng trong workdir
+    SHEET_CACHE.cache_dir = os.path.join(workdir, "sheets")
+    SHEET_CACHE._index_path = os.path.join(SHEET_CACHE.cache_dir, "index.json")
+
+    results = []
+    for rows in (int(r) for r in args.rows.split(",") if r.strip()):
+        print(f"... {rows} dòng", file=sys.stderr, flush=True)
+        results.append(bench_size(workdir, rows, args.cards, args.batch, args.workers, args.format,
+                                  args.signatures))
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"platform": platform.platform(), "python": platform.python_version(),
+                       "results": results}, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
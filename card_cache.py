@@ -0,0 +1,118 @@
+"""
+Cache thẻ đã render trên đĩa, địa chỉ hóa theo nội dung:
+key = card_digest của engine (phôi, layout đã resolve, giá trị trường, chữ ký) + scale + định dạng.
+In lại cùng danh sách (hôm sau, hoặc sau khi chỉnh trường không liên quan) thì thẻ không đổi
+được đọc thẳng từ file, bỏ qua bước vẽ PIL. Có giới hạn dung lượng, bỏ file lâu không dùng nhất trước.
+"""
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+CARD_CACHE_DIR = os.path.join(".cache", "cards")
+
+
+class CardCache:
+    """
+    Mỗi thẻ là 1 file <key> trong cache_dir. Thứ tự LRU giữ trong bộ nhớ, khởi tạo theo mtime
+    (mỗi lần đọc trúng sẽ os.utime) nên vẫn đúng qua các lần chạy. max_bytes=0: tắt cache.
+    Nhiều process cùng dùng 1 folder được: file bị process khác xóa thì coi như miss. Mỗi process
+    chỉ biết phần mình ghi, nên cứ ghi thêm max_bytes/32 là quét lại folder rồi mới bỏ file -> giới hạn
+    áp cho cả folder (vượt tối đa số process x max_bytes/32 giữa 2 lần quét).
+    """
+    def __init__(self, cache_dir=CARD_CACHE_DIR, max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._items = None  # OrderedDict key -> size, cũ nhất đứng đầu (quét folder lần đầu dùng)
+        self._size = 0
+        self._written = 0  # byte đã ghi từ lần quét folder gần nhất
+        self._lock = threading.Lock()
+
+    def __reduce__(self):
+        # Gửi sang process con: chỉ cần folder + giới hạn, process con tự quét lại
+        return CardCache, (self.cache_dir, self.max_bytes)
+
+    def _scan(self, force=False):
+        if self._items is not None and not force: return
+        entries = []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for e in it:
+                    if e.is_file() and not e.name.startswith(".tmp_"):
+                        st = e.stat()
+                        entries.append((st.st_mtime, e.name, st.st_size))
+        except FileNotFoundError:
+            pass
+        entries.sort()
+        self._items = OrderedDict((name, size) for _, name, size in entries)
+        self._size = sum(size for _, _, size in entries)
+        self._written = 0
+
+    def get(self, key):
+        if not self.max_bytes: return None
+        path = os.path.join(self.cache_dir, key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            data = None
+        with self._lock:
+            self._scan()
+            if data is None:
+                self.misses += 1
+                if key in self._items: self._size -= self._items.pop(key)
+                return None
+            self.hits += 1
+            if key in self._items:
+                self._items.move_to_end(key)
+            else:  # process khác vừa ghi
+                self._items[key] = len(data)
+                self._size += len(data)
+            return data
+
+    def put(self, key, data):
+        if not self.max_bytes or len(data) > self.max_bytes: return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".tmp_", dir=self.cache_dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, os.path.join(self.cache_dir, key))
+        with self._lock:
+            self._scan()
+            if key in self._items: self._size -= self._items.pop(key)
+            self._items[key] = len(data)
+            self._size += len(data)
+            self._written += len(data)
+            if self._written >= self.max_bytes // 32:  # process khác cũng đang ghi vào folder
+                self._scan(force=True)
+            self._evict()
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._items:
+            key, size = self._items.popitem(last=False)
+            self._size -= size
+            try:
+                os.remove(os.path.join(self.cache_dir, key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            self._scan()
+            return {"hits": self.hits, "misses": self.misses, "items": len(self._items), "bytes": self._size}
+
+    def clear(self):
+        with self._lock:
+            self._scan()
+            self._size, self._items, old = 0, OrderedDict(), self._items
+            for key in old:
+                try:
+                    os.remove(os.path.join(self.cache_dir, key))
+                except OSError:
+                    pass
+
+
+CARD_CACHE = CardCache()
@@ -0,0 +1,229 @@
+"""
+Nạp danh sách cử tri nhanh: Excel/CSV/Parquet, chỉ lấy các cột cần dùng,
+và cache bản chuyển đổi dạng cột (Parquet nếu có pyarrow, không thì pickle)
+theo hash nội dung file -> mở lại cùng danh sách gần như tức thì.
+"""
+import hashlib
+import json
+import os
+import re
+import unicodedata
+
+import pandas as pd
+
+from file_utils import atomic_write_text
+
+SHEET_CACHE_DIR = os.path.join(".cache", "sheets")
+# Đổi khi cách đọc file nguồn đổi (vd: CSV đọc dạng chuỗi) -> không dùng lại cache cũ
+SHEET_CACHE_VERSION = 2
+SHEET_FILETYPES = [("Danh sách", "*.xlsx;*.xls;*.csv;*.parquet"), ("Excel", "*.xlsx;*.xls"),
+                   ("CSV", "*.csv"), ("Parquet", "*.parquet")]
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow là tùy chọn
+    pq = None
+
+
+def read_source(path):
+    """Đọc toàn bộ file nguồn (chỉ chạy 1 lần cho mỗi nội dung file)."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        # Đọc dạng chuỗi: CCCD / số thẻ như "001090012345" phải giữ nguyên số 0 đầu
+        df = pd.read_csv(path, encoding="utf-8-sig", dtype=str, keep_default_na=False)
+    elif ext == ".parquet":
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_excel(path)
+    df.columns = df.columns.astype(str).str.strip()
+    return df
+
+
+def file_digest(path, chunk=1024 * 1024):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class SheetCache:
+    """
+    Cache bản dạng cột của file danh sách, key = sha1 nội dung file.
+    index.json nhớ (path, size, mtime) -> hash để không phải hash lại file chưa đổi.
+    Chỉ giữ max_entries danh sách dùng gần nhất (LRU theo mtime, mỗi lần đọc sẽ os.utime).
+    """
+    def __init__(self, cache_dir=SHEET_CACHE_DIR, max_entries=8):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._index_path = os.path.join(cache_dir, "index.json")
+        self._index = None
+        self._last = (None, None)  # (digest, DataFrame đầy đủ vừa parse)
+
+    # ----------------------------------------------------------------
+    # INDEX
+    # ----------------------------------------------------------------
+    def _load_index(self):
+        if self._index is None:
+            try:
+                with open(self._index_path, "r", encoding="utf-8") as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def digest(self, path):
+        st = os.stat(path)
+        key = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+        index = self._load_index()
+        if key not in index:
+            index[key] = file_digest(path)
+            self._save_index()
+        return index[key]
+
+    def _save_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        atomic_write_text(self._index_path, json.dumps(self._index))
+
+    # ----------------------------------------------------------------
+    # CACHE FILES
+    # ----------------------------------------------------------------
+    def _base(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}_v{SHEET_CACHE_VERSION}")
+
+    def _cached_file(self, digest):
+        for ext in (".parquet", ".pkl"):
+            p = self._base(digest) + ext
+            try:
+                os.utime(p)  # đánh dấu vừa dùng cho _evict
+                return p
+            except OSError:
+                pass
+        return None
+
+    def _build(self, path, digest):
+        df = read_source(path)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        base = self._base(digest)
+        written = False
+        if pq is not None:
+            try:
+                df.to_parquet(base + ".parquet", index=False)
+                written = True
+            except Exception:  # cột object lẫn kiểu (số + chữ) -> dùng pickle
+                if os.path.exists(base + ".parquet"): os.remove(base + ".parquet")
+        if not written:
+            df.to_pickle(base + ".pkl")
+        self._last = (digest, df)
+        self._evict()
+        return df
+
+    def _evict(self):
+        """Bỏ các file cache ngoài max_entries file dùng gần nhất, kèm các dòng index trỏ tới chúng."""
+        files = []
+        with os.scandir(self.cache_dir) as it:
+            for e in it:
+                if e.is_file() and e.name != "index.json" and not e.name.startswith(".tmp_"):
+                    files.append((e.stat().st_mtime, e.name))
+        files.sort(reverse=True)
+        for _, name in files[self.max_entries:]:
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+        kept = {name.split("_v")[0] for _, name in files[:self.max_entries]}
+        index = self._load_index()
+        stale = [k for k, digest in index.items() if digest not in kept]
+        for k in stale: del index[k]
+        if stale: self._save_index()
+
+    def columns(self, path):
+        """Tên tất cả các cột (đã strip) - dựng cache nếu file chưa từng được mở."""
+        digest = self.digest(path)
+        if self._last[0] == digest:
+            return self._last[1].columns.tolist()
+        cached = self._cached_file(digest)
+        if cached is None:
+            return self._build(path, digest).columns.tolist()
+        if cached.endswith(".parquet"):
+            return [c for c in pq.read_schema(cached).names if not c.startswith("__index")]
+        df = pd.read_pickle(cached)
+        self._last = (digest, df)
+        return df.columns.tolist()
+
+    def load(self, path, usecols=None):
+        """DataFrame chỉ gồm usecols (None = tất cả), giữ thứ tự cột như file gốc."""
+        digest = self.digest(path)
+        if self._last[0] == digest:
+            df = self._last[1]
+        else:
+            cached = self._cached_file(digest)
+            if cached is None:
+                df = self._build(path, digest)
+            elif cached.endswith(".parquet"):
+                names = pq.read_schema(cached).names
+                cols = None if usecols is None else [c for c in names if c in set(usecols)]
+                return pd.read_parquet(cached, columns=cols)
+            else:
+                df = pd.read_pickle(cached)
+                self._last = (digest, df)
+        if usecols is None:
+            return df.copy()
+        wanted = set(usecols)
+        return df[[c for c in df.columns if c in wanted]].copy()
+
+
+SHEET_CACHE = SheetCache()
+
+
+# ========================================================================================
+# COLUMN INDEX
+# ========================================================================================
+def normalize_header(text):
+    """'Số CCCD/CMND' -> 'so cccd cmnd': bỏ dấu tiếng Việt (cả đ), chữ thường, gộp ký tự lạ thành 1 dấu cách."""
+    text = unicodedata.normalize("NFD", str(text).replace("đ", "d").replace("Đ", "D"))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    return " ".join(re.sub(r"[^0-9a-z]+", " ", text).split())
+
+
+class ColumnIndex:
+    """
+    Dò cột theo vai trò (tên, giới tính, CCCD, ...) 1 lần cho mỗi bộ tiêu đề.
+    Khớp theo chuỗi con trên tiêu đề đã normalize, nên "Ho ten", "HỌ VÀ TÊN", "Số CCCD" đều nhận.
+    Cột đứng trước được ưu tiên (giống cách dò cũ).
+    """
+    def __init__(self, columns, roles=None):
+        self.columns = list(columns)
+        self._norm = [(c, normalize_header(c)) for c in self.columns]
+        self._found = {}
+        self.roles = {role: self.find(aliases) for role, aliases in (roles or {}).items()}
+
+    def find(self, aliases):
+        key = tuple(aliases)
+        if key not in self._found:
+            keys = [normalize_header(a) for a in aliases]
+            self._found[key] = next((c for c, norm in self._norm if any(k in norm for k in keys if k)), None)
+        return self._found[key]
+
+    def role(self, name):
+        return self.roles.get(name)
+
+
+def preformat_series(s):
+    """
+    Chuỗi hiển thị cho cả cột (vector hóa), thay cho str()/replace("nan")/split ngày từng ô:
+    - ô trống / NaN / NaT -> ""  (không còn xóa nhầm chữ "nan" trong tên thật)
+    - ngày giờ 00:00:00 -> chỉ giữ phần ngày
+    """
+    missing = s.isna() | s.eq("")
+    if pd.api.types.is_datetime64_any_dtype(s):
+        out = s.astype(str)
+        midnight = s.dt.normalize().eq(s)
+        out[midnight] = s[midnight].dt.strftime("%Y-%m-%d")
+    else:
+        out = s.astype(str)
+        has_time = out.str.contains("00:00:00", regex=False)
+        if has_time.any():
+            out[has_time] = out[has_time].str.split(" ").str[0]
+    out[missing] = ""
+    return out.tolist()
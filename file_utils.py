@@ -0,0 +1,20 @@
+"""
+Ghi file an toàn khi tắt máy / bị kill giữa chừng: dùng chung cho cấu hình, job_state.json, index cache.
+"""
+import os
+import tempfile
+
+
+def atomic_write_text(path, text):
+    """Ghi ra file tạm cùng thư mục rồi os.replace -> không bao giờ để lại file ghi dở."""
+    fd, tmp = tempfile.mkstemp(prefix=".tmp_", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try: os.remove(tmp)
+        except OSError: pass
+        raise
@@ -0,0 +1,116 @@
+"""
+Bình bản (N-up imposition): xếp nhiều thẻ lên 1 tờ giấy theo lưới, có lề và dấu cắt.
+Thẻ được render thẳng ở kích thước ô (theo DPI máy in) nên không phải resample lần 2.
+"""
+from PIL import Image, ImageDraw
+
+SHEET_SIZES_MM = {
+    "A4": (210, 297),
+    "A3": (297, 420),
+    "A5": (148, 210),
+}
+
+
+def mm_to_px(mm, dpi):
+    return int(round(mm * dpi / 25.4))
+
+
+class ImpositionLayout:
+    """Lưới cols x rows trên khổ giấy sheet_mm (dọc), lề margin_mm, khoảng cách ô gap_mm."""
+    def __init__(self, cols=2, rows=2, sheet="A4", margin_mm=8, gap_mm=6, dpi=300, cut_marks=True):
+        self.cols = max(1, int(cols))
+        self.rows = max(1, int(rows))
+        self.sheet_mm = SHEET_SIZES_MM.get(sheet, sheet) if isinstance(sheet, str) else tuple(sheet)
+        self.margin_mm = margin_mm
+        self.gap_mm = gap_mm
+        self.dpi = dpi
+        self.cut_marks = cut_marks
+
+    @classmethod
+    def parse(cls, spec, **kwargs):
+        """'2x3' -> 2 cột x 3 hàng."""
+        cols, rows = spec.lower().split("x")
+        return cls(int(cols), int(rows), **kwargs)
+
+    def to_dict(self):
+        return {"cols": self.cols, "rows": self.rows, "sheet": list(self.sheet_mm), "margin_mm": self.margin_mm,
+                "gap_mm": self.gap_mm, "dpi": self.dpi, "cut_marks": self.cut_marks}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data) if data else None
+
+    @property
+    def per_sheet(self):
+        return self.cols * self.rows
+
+    @property
+    def sheet_px(self):
+        return mm_to_px(self.sheet_mm[0], self.dpi), mm_to_px(self.sheet_mm[1], self.dpi)
+
+    @property
+    def cell_px(self):
+        sw, sh = self.sheet_px
+        margin, gap = mm_to_px(self.margin_mm, self.dpi), mm_to_px(self.gap_mm, self.dpi)
+        return ((sw - 2 * margin - (self.cols - 1) * gap) // self.cols,
+                (sh - 2 * margin - (self.rows - 1) * gap) // self.rows)
+
+    def card_scale(self, card_size):
+        """Hệ số scale để thẻ (kích thước phôi gốc) vừa khít 1 ô, giữ tỉ lệ."""
+        cw, ch = self.cell_px
+        return min(cw / card_size[0], ch / card_size[1])
+
+    def cell_origin(self, i):
+        margin, gap = mm_to_px(self.margin_mm, self.dpi), mm_to_px(self.gap_mm, self.dpi)
+        cw, ch = self.cell_px
+        col, row = i % self.cols, i // self.cols
+        return margin + col * (cw + gap), margin + row * (ch + gap)
+
+    def card_origin(self, i, card_w, card_h):
+        """Góc trên-trái của thẻ thứ i khi căn giữa trong ô."""
+        ox, oy = self.cell_origin(i)
+        cw, ch = self.cell_px
+        return ox + (cw - card_w) // 2, oy + (ch - card_h) // 2
+
+    def cut_mark_lines(self, x1, y1, x2, y2):
+        """(các đoạn thẳng, độ dày) của dấu cắt quanh thẻ (x1, y1, x2, y2) - dùng cho cả tờ raster lẫn vector."""
+        dpi = self.dpi
+        # Dấu cắt cách góc thẻ 1mm, dài tối đa 4mm và không lấn sang thẻ bên cạnh
+        off = mm_to_px(1, dpi)
+        ln = min(mm_to_px(4, dpi), max(off + 1, mm_to_px(self.gap_mm, dpi) - off))
+        lines = []
+        for cx, sx in ((x1, -1), (x2, 1)):
+            for cy, sy in ((y1, -1), (y2, 1)):
+                lines.append(((cx + sx * off, cy), (cx + sx * ln, cy)))
+                lines.append(((cx, cy + sy * off), (cx, cy + sy * ln)))
+        return lines, max(1, dpi // 150)
+
+
+class SheetImposer:
+    def __init__(self, layout):
+        self.layout = layout
+
+    def new_sheet(self):
+        sheet = Image.new("RGB", self.layout.sheet_px, "white")
+        sheet.info["dpi"] = (self.layout.dpi, self.layout.dpi)
+        return sheet
+
+    def place(self, sheet, i, card):
+        """Dán thẻ thứ i (0-based) vào giữa ô tương ứng, vẽ dấu cắt quanh thẻ."""
+        x, y = self.layout.card_origin(i, card.width, card.height)
+        sheet.paste(card, (x, y))
+        if self.layout.cut_marks:
+            self._draw_cut_marks(sheet, x, y, x + card.width, y + card.height)
+
+    def _draw_cut_marks(self, sheet, x1, y1, x2, y2):
+        draw = ImageDraw.Draw(sheet)
+        lines, width = self.layout.cut_mark_lines(x1, y1, x2, y2)
+        for line in lines:
+            draw.line(line, fill="black", width=width)
+
+    def compose(self, cards):
+        """Ghép tối đa per_sheet thẻ thành 1 tờ."""
+        sheet = self.new_sheet()
+        for i, card in enumerate(cards):
+            self.place(sheet, i, card)
+        return sheet
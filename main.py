@@ -1,29 +1,33 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from PIL import Image, ImageDraw, ImageFont, ImageTk
-import pandas as pd
+from PIL import ImageTk
 import os
-import json
-import platform
-import win32api
-import time
+import threading
 from copy import deepcopy
 
+from data_loader import SHEET_FILETYPES
+from imposition import ImpositionLayout
+from profiling import PROFILER
+from render_engine import SIGNATURE_CACHE, PreviewPyramid, RenderEngine
+from spooler import JOB_STATE_FILE, JobState, PrintSpooler, default_backend, start_print_thread
+from voter_list import VirtualVoterList
+
 # ========================================================================================
 # CẤU HÌNH & HẰNG SỐ (CONSTANTS)
 # ========================================================================================
-CONFIG_FILE = "cau_hinh_v12_final.json"
-
 COLORS = {
     "primary": "#3498db", "success": "#2ecc71", "danger": "#e74c3c",
     "warning": "#f39c12", "purple": "#9b59b6", "dark": "#2c3e50",
     "light": "#ecf0f1", "grey": "#bdc3c7", "text": "#2c3e50", "white": "#ffffff"
 }
 
-FONT_MAP = {
-    "Arial": {"normal": "arial.ttf", "bold": "arialbd.ttf"},
-    "Times New Roman": {"normal": "times.ttf", "bold": "timesbd.ttf"},
-    "Calibri": {"normal": "calibri.ttf", "bold": "calibrib.ttf"}
+# Số thẻ/tờ -> lưới (cột, hàng) trên A4 dọc
+NUP_PRESETS = {
+    "1 thẻ/tờ": None,
+    "2 thẻ/tờ": (1, 2),
+    "4 thẻ/tờ": (2, 2),
+    "6 thẻ/tờ": (2, 3),
+    "8 thẻ/tờ": (2, 4),
 }
 
 # ========================================================================================
@@ -92,8 +96,9 @@ class RoundedButton(tk.Canvas):
 # ========================================================================================
 # MAIN APPLICATION
 # ========================================================================================
-class VoterAppV12Final:
+class VoterAppV12Final(RenderEngine):
     def __init__(self, root):
+        super().__init__()
         self.root = root
         self.root.title("HỆ THỐNG IN THẺ CỬ TRI")
         self.root.geometry("1600x950")
@@ -102,6 +107,8 @@ class VoterAppV12Final:
         self._setup_styles()
         self._init_variables()
         self.load_config_file()
+        # Gom các lần sửa cấu hình liên tiếp, ghi trên luồng Tk
+        self.config_writer.scheduler = self.root.after
         self.setup_ui_layout()
 
     def _setup_styles(self):
@@ -116,15 +123,19 @@ class VoterAppV12Final:
                   foreground=[('selected', 'white')])
 
     def _init_variables(self):
-        # Data variables
-        self.df = None
-        self.template_path = None
-        self.signature_folder = None
+        # Data variables (df, template_path, signature_folder, configs) nằm trong RenderEngine
         
         # Image variables
         self.pil_image = None
         self.tk_image = None
+        self.tk_image_key = None
+        self.tk_image_sharp = False
+        self.refine_job = None
+        self.preview = PreviewPyramid()
+        self.bg_item = None
+        self.overlay_items = {}
         self.tk_sig_ref = None 
+        self.tk_sig_key = None
         self.scale_factor = 1.0 
         self.zoom_multiplier = 1.0
         self.img_origin_x = 0
@@ -132,9 +143,10 @@ class VoterAppV12Final:
 
         # State variables
         self.current_idx = 0
+        self.spooler = None
+        self.print_cancel = None
+        self._render_failed = False
         self.drag_data = {"x": 0, "y": 0, "item": None}
-        self.global_config = {}
-        self.custom_configs = {}
         
         # UI Reference variables
         self.chk_field_vars = {}
@@ -270,40 +282,33 @@ class VoterAppV12Final:
         RoundedButton(left_tool, text="Bỏ Chọn", command=self.deselect_all, bg=COLORS["grey"], width=90, height=30).pack(side=tk.LEFT)
         RoundedButton(toolbar_frame, text="🖨️ IN NGAY", command=self.start_batch_print, bg=COLORS["danger"], width=100, height=30).pack(side=tk.RIGHT)
         
+        # Số thẻ trên 1 tờ giấy A4 (bình bản N-up)
+        self.combo_nup = ttk.Combobox(toolbar_frame, values=list(NUP_PRESETS), width=10, state="readonly")
+        self.combo_nup.set("1 thẻ/tờ")
+        self.combo_nup.pack(side=tk.RIGHT, padx=5)
+        
+        # PDF chữ vector: phôi nhúng 1 lần, chữ dùng font subset -> file gửi máy in nhỏ hơn nhiều
+        self.chk_vector_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(toolbar_frame, text="Chữ vector", variable=self.chk_vector_var, bg="white").pack(side=tk.RIGHT, padx=5)
+        
         self.lbl_count = tk.Label(self.mid_panel, text="Đã chọn: 0", font=("Segoe UI", 10, "bold"), fg=COLORS["danger"], bg="white")
         self.lbl_count.pack(anchor="e", pady=(0, 5))
+        self.lbl_status = tk.Label(self.mid_panel, text="", font=("Segoe UI", 9), fg=COLORS["dark"], bg="white")
+        self.lbl_status.pack(anchor="e", pady=(0, 5))
+        
+        # Tiến độ đợt in: chỉ hiện trong lúc đang in
+        self.progress_frame = tk.Frame(self.mid_panel, bg="white")
+        self.progress_bar = ttk.Progressbar(self.progress_frame, mode="determinate", maximum=1)
+        self.progress_bar.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 5))
+        tk.Button(self.progress_frame, text="Hủy", command=self.cancel_batch_print, 
+                  bg=COLORS["grey"], relief="flat", padx=10).pack(side=tk.RIGHT)
 
-        # --- Treeview với Grid Layout để fix lỗi hiển thị thanh cuộn ---
-        tree_container = tk.Frame(self.mid_panel, bg="white")
-        tree_container.pack(fill=tk.BOTH, expand=True)
-
-        # Cấu hình Grid
-        tree_container.rowconfigure(0, weight=1)
-        tree_container.columnconfigure(0, weight=1)
-
+        # --- Danh sách ảo: chỉ tạo dòng Treeview cho phần đang nhìn thấy ---
         cols = [("stt", "STT", 40), ("name", "Họ Tên", 180), 
                 ("gender", "Giới tính", 60), ("cccd", "CCCD", 100), ("area", "Khu vực", 120)]
         
-        self.tree = ttk.Treeview(tree_container, columns=[c[0] for c in cols], show="headings", selectmode="extended")
-        
-        for c_id, c_name, c_width in cols:
-            self.tree.heading(c_id, text=c_name)
-            self.tree.column(c_id, width=c_width, anchor="center" if c_id in ["stt", "gender"] else "w")
-            
-        self.tree.tag_configure('custom', foreground='red', font=('Segoe UI', 10, 'bold'))
-        
-        # Scrollbars
-        ysb = ttk.Scrollbar(tree_container, orient="vertical", command=self.tree.yview)
-        xsb = ttk.Scrollbar(tree_container, orient="horizontal", command=self.tree.xview)
-        self.tree.configure(yscrollcommand=ysb.set, xscrollcommand=xsb.set)
-        
-        # Grid Placement (Đây là phần fix lỗi)
-        self.tree.grid(row=0, column=0, sticky="nsew")
-        ysb.grid(row=0, column=1, sticky="ns")
-        xsb.grid(row=1, column=0, sticky="ew")
-        
-        # Events
-        self.tree.bind("<<TreeviewSelect>>", self.on_tree_select_change)
+        self.voter_list = VirtualVoterList(self.mid_panel, cols, on_select=self.on_tree_select_change, bg="white")
+        self.voter_list.pack(fill=tk.BOTH, expand=True)
 
     def _setup_right_panel(self):
         self.canvas = tk.Canvas(self.right_panel, bg="#95a5a6", cursor="fleur")
@@ -332,46 +337,18 @@ class VoterAppV12Final:
         # Giới hạn zoom để không quá bé hoặc quá to (từ 10% đến 500%)
         if self.zoom_multiplier < 0.1: self.zoom_multiplier = 0.1
         if self.zoom_multiplier > 5.0: self.zoom_multiplier = 5.0
-        self.render_canvas()
+        self.render_canvas(fast=True)
 
     # ----------------------------------------------------------------
     # LOGIC: CONFIGURATION & DATA MANAGEMENT
     # ----------------------------------------------------------------
-    def load_config_file(self):
-        if os.path.exists(CONFIG_FILE):
-            try:
-                with open(CONFIG_FILE, "r", encoding="utf-8") as f: 
-                    data = json.load(f)
-                    self.global_config = data.get("global", {})
-                    self.custom_configs = {int(k): v for k, v in data.get("custom", {}).items()}
-            except Exception: 
-                pass
-        
-        if "signature_img" not in self.global_config:
-            self.global_config["signature_img"] = {"x": 300, "y": 300, "w": 150, "h": 80, 
-                                                  "enable": True, "type": "image"}
-
-    def save_config_file(self):
-        data = {"global": self.global_config, "custom": self.custom_configs}
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f: 
-            json.dump(data, f, ensure_ascii=False, indent=4)
-
-    def get_current_config(self, idx):
-        config = deepcopy(self.global_config)
-        if idx in self.custom_configs:
-            for col, props in self.custom_configs[idx].items():
-                if col in config: 
-                    config[col].update(props)
-                else: 
-                    config[col] = props
-        return config
-
     def update_config_value(self, col, key, value):
         mode = self.edit_mode.get()
         if mode == "global":
-            if col in self.global_config:
+            if col in self.global_config and self.global_config[col].get(key) != value:
                 self.global_config[col][key] = value
-                self.save_config_file()
+                self.invalidate_layout()
+                self.schedule_config_save()
         else:
             idx = self.current_idx
             if idx not in self.custom_configs: 
@@ -380,8 +357,9 @@ class VoterAppV12Final:
                 self.custom_configs[idx][col] = deepcopy(self.global_config.get(col, {}))
             
             self.custom_configs[idx][col][key] = value
-            self.save_config_file()
-            self.tree.item(idx, tags=('custom',))
+            self.invalidate_layout(idx)
+            self.schedule_config_save(idx)
+            self.voter_list.refresh_row(idx)
 
     # ----------------------------------------------------------------
     # LOGIC: FILE HANDLING
@@ -389,23 +367,23 @@ class VoterAppV12Final:
     def select_template(self):
         path = filedialog.askopenfilename(filetypes=[("Image", "*.jpg;*.png")])
         if path: 
-            self.template_path = path
-            self.pil_image = Image.open(path)
+            self.set_template(path)
+            self.pil_image = self.template_cache.master(path)
+            self.tk_image_key = None  # phôi mới cùng kích thước vẫn phải dựng lại ảnh nền
             self.render_canvas()
 
     def select_signature_folder(self):
         folder = filedialog.askdirectory()
         if folder: 
-            self.signature_folder = folder
+            self.set_signature_folder(folder)
             self.refresh_field_list()
-            messagebox.showinfo("OK", f"Đã chọn folder: {folder}")
+            messagebox.showinfo("OK", f"Đã chọn folder: {folder}\n({len(self.signature_index)} ảnh chữ ký)")
 
     def select_excel(self):
-        path = filedialog.askopenfilename(filetypes=[("Excel", "*.xlsx;*.xls")])
+        path = filedialog.askopenfilename(filetypes=SHEET_FILETYPES)
         if path:
             try:
-                self.df = pd.read_excel(path).fillna("")
-                self.df.columns = self.df.columns.str.strip()
+                self.load_excel(path)
                 self.refresh_field_list()
                 self.populate_treeview()
                 self.render_canvas()
@@ -418,7 +396,7 @@ class VoterAppV12Final:
         
         self.chk_field_vars = {}
         self.field_labels = {}
-        cols = self.df.columns.tolist() if self.df is not None else []
+        cols = list(self.sheet_columns) if self.df is not None else []
         if "signature_img" not in cols: 
             cols.append("signature_img")
         
@@ -426,6 +404,7 @@ class VoterAppV12Final:
             if col not in self.global_config:
                 self.global_config[col] = {"x": 50, "y": 50, "size": 30, "enable": False, 
                                           "font": "Arial", "color": "Black", "type": "text"}
+                self.invalidate_layout()
             
             row_fr = tk.Frame(self.scrollable_frame, bg="white")
             row_fr.pack(fill="x", pady=2)
@@ -445,45 +424,37 @@ class VoterAppV12Final:
 
     def on_field_toggle(self, col):
         self.global_config[col]["enable"] = self.chk_field_vars[col].get()
-        self.save_config_file()
+        if self.global_config[col]["enable"]:
+            self.ensure_columns([col])
+        self.invalidate_layout()
+        self.schedule_config_save()
         self.load_props(col)
         self.render_canvas()
 
     def populate_treeview(self):
-        for i in self.tree.get_children(): 
-            self.tree.delete(i)
+        col_name, col_gender, col_cccd, col_area = (
+            self.role_column(r) for r in ("name", "gender", "cccd", "area"))
         
-        col_name = self._find_column_insensitive(["Họ tên", "Họ và tên", "Name"])
-        col_gender = self._find_column_insensitive(["Giới tính", "Gender"])
-        col_cccd = self._find_column_insensitive(["CCCD", "CMND"])
-        col_area = self._find_column_insensitive(["Khu vực", "Thôn"])
+        # Lấy sẵn dạng list theo cột, dòng nào hiện ra mới ghép lại thành tuple
+        columns = [self.display_column(c) if c else None for c in (col_name, col_gender, col_cccd, col_area)]
         
-        if not col_name and len(self.df.columns) > 1: 
-            col_name = self.df.columns[1]
+        def get_values(i):
+            return (i+1,) + tuple(col[i] if col else "" for col in columns)
         
-        for i, row in self.df.iterrows():
-            tag = ('custom',) if i in self.custom_configs else ()
-            vals = (i+1, row.get(col_name,""), row.get(col_gender,""), 
-                    row.get(col_cccd,""), row.get(col_area,""))
-            self.tree.insert("", "end", iid=i, values=vals, tags=tag)
+        def get_tags(i):
+            return ('custom',) if i in self.custom_configs else ()
         
+        self.voter_list.set_source(len(self.df), get_values, get_tags)
+        self.current_idx = 0
         self.select_all()
 
-    def _find_column_insensitive(self, keywords):
-        if self.df is None: return None
-        for col in self.df.columns:
-            for kw in keywords:
-                if kw.lower() in col.lower(): return col
-        return None
-
     # ----------------------------------------------------------------
     # LOGIC: IMAGE RENDERING
     # ----------------------------------------------------------------
-    def render_canvas(self):
+    def render_canvas(self, fast=False):
+        """fast=True khi đang zoom liên tục: nền resize nhanh, lúc dừng tay mới làm nét lại."""
         if not self.template_path or self.pil_image is None: 
             return
-            
-        self.canvas.delete("all")
         
         cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
         if cw < 50: cw, ch = 800, 600
@@ -499,120 +470,141 @@ class VoterAppV12Final:
 
         nw, nh = int(iw * self.scale_factor), int(ih * self.scale_factor)
         
-        self.tk_image = ImageTk.PhotoImage(self.pil_image.resize((nw, nh), Image.Resampling.LANCZOS))
+        self._update_preview_image(nw, nh, fast)
         
         # Tính toán để ảnh luôn nằm giữa canvas
         cx, cy = cw//2, ch//2
         self.img_origin_x = cx - nw//2
         self.img_origin_y = cy - nh//2
         
-        self.canvas.create_image(cx, cy, image=self.tk_image, anchor=tk.CENTER)
+        # Nền: giữ 1 item duy nhất, chỉ đổi ảnh/vị trí
+        if self.bg_item is None:
+            self.bg_item = self.canvas.create_image(cx, cy, image=self.tk_image, anchor=tk.CENTER)
+        else:
+            self.canvas.coords(self.bg_item, cx, cy)
+            self.canvas.itemconfig(self.bg_item, image=self.tk_image)
+        self.canvas.tag_lower(self.bg_item)
         
-        if self.df is not None:
-            self._render_overlay_on_canvas()
+        self._render_overlay_on_canvas()
+
+    def _update_preview_image(self, nw, nh, fast):
+        # Cùng phôi, cùng kích thước (đổi dòng, kéo thả, sửa style) -> dùng lại PhotoImage cũ
+        key = (id(self.pil_image), nw, nh)
+        if self.tk_image_key == key and (self.tk_image_sharp or fast):
+            return
+        self.tk_image = ImageTk.PhotoImage(self.preview.get(self.pil_image, (nw, nh), fast))
+        self.tk_image_key = key
+        self.tk_image_sharp = not fast or self.preview.has_sharp((nw, nh))
+        
+        if self.refine_job:
+            self.root.after_cancel(self.refine_job)
+            self.refine_job = None
+        if not self.tk_image_sharp:
+            self.refine_job = self.root.after(300, self._refine_preview)
+
+    def _refine_preview(self):
+        self.refine_job = None
+        self.render_canvas()
 
+    # ----------------------------------------------------------------
+    # OVERLAY (retained mode): mỗi trường giữ item canvas của nó,
+    # chỉ cấu hình lại trường nào có trạng thái khác lần vẽ trước
+    # ----------------------------------------------------------------
     def _render_overlay_on_canvas(self):
-        row = self.df.iloc[self.current_idx]
-        final_config = self.get_current_config(self.current_idx)
+        layout = self.get_layout(self.current_idx) if self.df is not None else ()
         
-        for col, cfg in final_config.items():
-            if not cfg.get("enable", False): 
-                continue
-            
-            sx = self.img_origin_x + cfg["x"] * self.scale_factor
-            sy = self.img_origin_y + cfg["y"] * self.scale_factor
+        seen = set()
+        for spec in layout:
+            sx = self.img_origin_x + spec.x * self.scale_factor
+            sy = self.img_origin_y + spec.y * self.scale_factor
             
-            if col == "signature_img":
-                self._draw_signature_on_canvas(col, cfg, sx, sy)
+            if spec.kind == "image":
+                state = self._signature_state(spec, sx, sy)
             else:
-                self._draw_text_on_canvas(col, cfg, row, sx, sy)
+                state = self._text_state(spec, sx, sy)
+            self._apply_overlay_state(spec.name, state)
+            seen.add(spec.name)
+        
+        for col in [c for c in self.overlay_items if c not in seen]:
+            self._delete_overlay(col)
 
-    def _draw_text_on_canvas(self, col, cfg, row, sx, sy):
-        val = str(row.get(col, "")).replace("nan", "")
-        if "00:00:00" in val: val = val.split(" ")[0]
-        if cfg.get("upper", False): val = val.upper()
+    def _text_state(self, spec, sx, sy):
+        col = spec.name
+        val = self.display_value(self.current_idx, col, spec.upper)
         
-        f_sz = int(cfg.get("size", 30) * self.scale_factor)
-        tk_font = (cfg.get("font", "Arial"), -f_sz, "bold" if cfg.get("bold", False) else "normal")
+        f_sz = int(spec.size * self.scale_factor)
+        tk_font = (spec.font, -f_sz, "bold" if spec.bold else "normal")
         
         is_custom = (self.edit_mode.get() == "individual" and 
                      self.current_idx in self.custom_configs and 
                      col in self.custom_configs[self.current_idx])
-        clr = "red" if is_custom else cfg.get("color", "black")
-        
-        self.canvas.create_text(sx, sy, text=val, font=tk_font, fill=clr, 
-                                anchor="center", tags=("draggable", f"col:{col}"))
-
-    def _draw_signature_on_canvas(self, col, cfg, sx, sy):
-        w = int(cfg.get("w", 150) * self.scale_factor)
-        h = int(cfg.get("h", 80) * self.scale_factor)
-        sig = self.get_signature_image(self.current_idx)
-        
-        if sig:
-            self.tk_sig_ref = ImageTk.PhotoImage(sig.resize((w, h), Image.Resampling.LANCZOS))
-            self.canvas.create_image(sx, sy, image=self.tk_sig_ref, anchor="center", 
-                                     tags=("draggable", f"col:{col}"))
-            self.canvas.create_rectangle(sx - w/2, sy - h/2, sx + w/2, sy + h/2, 
-                                         outline="blue", dash=(2, 4), tags=("draggable", f"col:{col}"))
+        clr = "red" if is_custom else spec.color
+        return {"kind": "text", "xy": (sx, sy), "text": val, "font": tk_font, "fill": clr}
+
+    def _signature_state(self, spec, sx, sy):
+        w = int(spec.w * self.scale_factor)
+        h = int(spec.h * self.scale_factor)
+        path = self.get_signature_path(self.current_idx)
+        
+        if path and w > 0 and h > 0:
+            # Chỉ tạo PhotoImage mới khi đổi ảnh / đổi kích thước hiển thị
+            key = SIGNATURE_CACHE.key(path, w, h)
+            if key != self.tk_sig_key:
+                self.tk_sig_ref = ImageTk.PhotoImage(SIGNATURE_CACHE.get(path, w, h))
+                self.tk_sig_key = key
+            return {"kind": "signature", "xy": (sx, sy), "wh": (w, h), "image": key}
+        return {"kind": "placeholder", "xy": (sx, sy), "wh": (w, h)}
+
+    def _apply_overlay_state(self, col, state):
+        entry = self.overlay_items.get(col)
+        if entry and entry["state"] == state:
+            return
+        if entry is None or entry["kind"] != state["kind"]:
+            if entry: self._delete_overlay(col)
+            entry = self.overlay_items[col] = {"kind": state["kind"], "ids": self._create_overlay(col, state)}
         else:
-            self.canvas.create_rectangle(sx - w/2, sy - h/2, sx + w/2, sy + h/2, 
-                                         outline="red", width=2, dash=(5, 2), 
-                                         tags=("draggable", f"col:{col}"))
-            self.canvas.create_text(sx, sy, text="CHỖ ĐỂ ẢNH", fill="red", 
-                                    font=("Segoe UI", 8, "bold"), justify="center", 
-                                    tags=("draggable", f"col:{col}"))
-
-    def render_one_image(self, idx):
-        if not self.template_path: return None
-        row = self.df.iloc[idx]
-        img = Image.open(self.template_path).convert("RGB")
-        draw = ImageDraw.Draw(img)
-        final_config = self.get_current_config(idx)
-        
-        for col, cfg in final_config.items():
-            if not cfg.get("enable", False): continue
-            
-            if col == "signature_img":
-                sig = self.get_signature_image(idx)
-                if sig:
-                    w, h = cfg.get("w", 150), cfg.get("h", 80)
-                    sig = sig.resize((w, h), Image.Resampling.LANCZOS)
-                    img.paste(sig, (int(cfg["x"] - w/2), int(cfg["y"] - h/2)), sig)
-            else:
-                val = str(row.get(col, "")).replace("nan", "")
-                if "00:00:00" in val: val = val.split(" ")[0]
-                if cfg.get("upper", False): val = val.upper()
-                
-                font_path = self._get_font_path(cfg.get("font", "Arial"), cfg.get("bold", False))
-                try:
-                    font = ImageFont.truetype(font_path, cfg.get("size", 30))
-                except:
-                    font = ImageFont.load_default()
-                
-                draw.text((cfg["x"], cfg["y"]), val, font=font, fill=cfg.get("color", "black"), anchor="mm")
-        return img
-
-    def _get_font_path(self, font_name, is_bold):
-        if platform.system() == "Windows":
-            style = "bold" if is_bold else "normal"
-            f_file = FONT_MAP.get(font_name, FONT_MAP["Arial"]).get(style, "arial.ttf")
-            return os.path.join(os.environ["WINDIR"], "Fonts", f_file)
-        return "arial.ttf"
-
-    def get_signature_image(self, idx):
-        if idx in self.custom_configs and "signature_img" in self.custom_configs[idx]:
-            p = self.custom_configs[idx]["signature_img"].get("path")
-            if p and os.path.exists(p): return Image.open(p).convert("RGBA")
-        
-        if self.signature_folder:
-            row = self.df.iloc[idx]
-            cccd = str(row.get(self._find_column_insensitive(["CCCD", "CMND"]) or "", "")).strip()
-            names = [cccd, str(idx+1)] if cccd else [str(idx+1)]
-            for n in names:
-                for ext in [".png", ".jpg", ".jpeg"]:
-                    p = os.path.join(self.signature_folder, n + ext)
-                    if os.path.exists(p): return Image.open(p).convert("RGBA")
-        return None
+            self._configure_overlay(entry["ids"], state)
+        entry["state"] = state
+
+    def _create_overlay(self, col, state):
+        tags = ("draggable", f"col:{col}")
+        kind = state["kind"]
+        if kind == "text":
+            return [self.canvas.create_text(*state["xy"], text=state["text"], font=state["font"], 
+                                            fill=state["fill"], anchor="center", tags=tags)]
+        if kind == "signature":
+            ids = [self.canvas.create_image(*state["xy"], image=self.tk_sig_ref, anchor="center", tags=tags),
+                   self.canvas.create_rectangle(0, 0, 0, 0, outline="blue", dash=(2, 4), tags=tags)]
+        else:
+            ids = [self.canvas.create_rectangle(0, 0, 0, 0, outline="red", width=2, dash=(5, 2), tags=tags),
+                   self.canvas.create_text(*state["xy"], text="CHỖ ĐỂ ẢNH", fill="red", 
+                                           font=("Segoe UI", 8, "bold"), justify="center", tags=tags)]
+        self._configure_overlay(ids, state)
+        return ids
+
+    def _configure_overlay(self, ids, state):
+        sx, sy = state["xy"]
+        kind = state["kind"]
+        if kind == "text":
+            self.canvas.coords(ids[0], sx, sy)
+            self.canvas.itemconfig(ids[0], text=state["text"], font=state["font"], fill=state["fill"])
+            return
+        
+        w, h = state["wh"]
+        box = (sx - w/2, sy - h/2, sx + w/2, sy + h/2)
+        if kind == "signature":
+            self.canvas.coords(ids[0], sx, sy)
+            self.canvas.itemconfig(ids[0], image=self.tk_sig_ref)
+            self.canvas.coords(ids[1], *box)
+        else:
+            self.canvas.coords(ids[0], *box)
+            self.canvas.coords(ids[1], sx, sy)
+
+    def _delete_overlay(self, col):
+        entry = self.overlay_items.pop(col, None)
+        if entry:
+            for item in entry["ids"]:
+                self.canvas.delete(item)
 
     # ----------------------------------------------------------------
     # EVENTS: DRAG & DROP
@@ -622,15 +614,19 @@ class VoterAppV12Final:
         if items:
             tags = self.canvas.gettags(items[0])
             if "draggable" in tags:
-                self.drag_data = {"x": e.x, "y": e.y, "item": items[0]}
+                self.drag_data = {"x": e.x, "y": e.y, "item": items[0], "col": None}
                 for t in tags:
                     if t.startswith("col:"): 
-                        self.load_props(t.split(":")[1])
+                        self.drag_data["col"] = t.split(":", 1)[1]
+                        self.load_props(self.drag_data["col"])
                         break
     
     def on_drag_motion(self, e):
         if self.drag_data["item"]:
-            self.canvas.move(self.drag_data["item"], e.x - self.drag_data["x"], e.y - self.drag_data["y"])
+            # Kéo cả nhóm item của trường (ảnh chữ ký + khung viền)
+            entry = self.overlay_items.get(self.drag_data.get("col"))
+            for item in (entry["ids"] if entry else [self.drag_data["item"]]):
+                self.canvas.move(item, e.x - self.drag_data["x"], e.y - self.drag_data["y"])
             self.drag_data.update({"x": e.x, "y": e.y})
             
     def on_drag_end(self, e):
@@ -645,7 +641,10 @@ class VoterAppV12Final:
                 real_y = int((cy - self.img_origin_y) / self.scale_factor)
                 self.update_config_value(self.selected_field_name, "x", real_x)
                 self.update_config_value(self.selected_field_name, "y", real_y)
-                self.render_canvas()
+            # Item đã bị move bằng tay -> buộc cấu hình lại vị trí theo config
+            entry = self.overlay_items.get(self.drag_data.get("col"))
+            if entry: entry["state"] = None
+            self.render_canvas()
         self.drag_data["item"] = None
 
     # ----------------------------------------------------------------
@@ -660,7 +659,7 @@ class VoterAppV12Final:
                     {"bg": "white", "fg": "black", "font": ("Segoe UI", 10)}
             lbl.config(**style)
         
-        cfg = self.get_current_config(self.current_idx).get(col, {})
+        cfg = self.get_field_config(self.current_idx, col)
         
         if col == "signature_img":
             self.btn_manual_sig.pack(side=tk.TOP, fill=tk.X, pady=5)
@@ -710,8 +709,9 @@ class VoterAppV12Final:
         idx = self.current_idx
         if idx in self.custom_configs:
             del self.custom_configs[idx]
-            self.save_config_file()
-            self.tree.item(idx, tags=())
+            self.invalidate_layout(idx)
+            self.schedule_config_save(idx)
+            self.voter_list.refresh_row(idx)
             self.render_canvas()
             self.load_props(self.selected_field_name)
             messagebox.showinfo("Reset", "Đã xóa chỉnh sửa riêng.")
@@ -728,64 +728,135 @@ class VoterAppV12Final:
         
         self.custom_configs[idx]["signature_img"]["path"] = path
         self.custom_configs[idx]["signature_img"]["enable"] = True
+        self.invalidate_layout(idx)
         
         if "signature_img" in self.chk_field_vars:
             self.chk_field_vars["signature_img"].set(True)
         
-        self.save_config_file()
-        self.tree.item(idx, tags=('custom',))
+        self.schedule_config_save(idx)
+        self.voter_list.refresh_row(idx)
         self.render_canvas()
 
     def select_all(self): 
-        self.tree.selection_set(self.tree.get_children())
-        self.update_count_label()
+        self.voter_list.select_all()
         
     def deselect_all(self): 
-        self.tree.selection_set([])
-        self.update_count_label()
+        self.voter_list.deselect_all()
     
-    def on_tree_select_change(self, event):
-        sel = self.tree.selection()
-        if sel: 
-            self.current_idx = int(sel[0])
+    def on_tree_select_change(self, current=None):
+        if current is not None:
+            self.current_idx = current
             self.render_canvas()
             if self.selected_field_name: 
                 self.load_props(self.selected_field_name)
         self.update_count_label()
         
     def update_count_label(self): 
-        self.lbl_count.config(text=f"Sẽ in: {len(self.tree.selection())} người")
+        self.lbl_count.config(text=f"Sẽ in: {self.voter_list.selection.count} người")
 
     def start_batch_print(self):
-        sel = self.tree.selection()
-        if not sel: 
-            return messagebox.showwarning("Chú ý", "Chưa chọn người!")
-        
-        if not messagebox.askyesno("In", f"In {len(sel)} thẻ?"): 
-            return
-        
-        output_dir = "temp_batch_final"
-        if not os.path.exists(output_dir): 
-            os.makedirs(output_dir)
-        
-        for iid in sel:
-            idx = int(iid)
-            img = self.render_one_image(idx)
-            if img:
-                fn = os.path.join(output_dir, f"job_{idx}.pdf")
-                img.save(fn)
-                try:
-                    win32api.ShellExecute(0, "print", fn, None, ".", 0)
-                    time.sleep(1.5)
-                except Exception as e: 
-                    print(f"Print error: {e}")
-        
-        messagebox.showinfo("Xong", "Đã gửi lệnh in.")
+        if self.spooler is not None and self.spooler.is_alive():
+            return messagebox.showwarning("Chú ý", "Đợt in trước chưa xong!")
+        
+        state_path = os.path.join("temp_batch_final", JOB_STATE_FILE)
+        job = JobState.load(state_path)
+        if job is not None and job.matches(self.job_source()):
+            left = len(job.indices) - job.cards_done()
+            answer = messagebox.askyesnocancel(
+                "In tiếp", f"Còn đợt in dở: {left}/{len(job.indices)} thẻ chưa gửi in.\n\n"
+                           "Có: in tiếp đợt đó\nKhông: bỏ đợt đó, in lựa chọn hiện tại")
+            if answer is None: 
+                return
+            if not answer:
+                job.discard()
+                job = None
+        else:
+            job = None
+        
+        if job is None:
+            sel = self.voter_list.selection.indices()
+            if not sel: 
+                return messagebox.showwarning("Chú ý", "Chưa chọn người!")
+            if not messagebox.askyesno("In", f"In {len(sel)} thẻ?"): 
+                return
+            grid = NUP_PRESETS.get(self.combo_nup.get())
+            layout = ImpositionLayout(*grid) if grid else None
+            job = JobState.new(state_path, sel, layout=layout, source=self.job_source(),
+                               vector=self.chk_vector_var.get())
+            job.save()
+        
+        # Render (thread nền) và gửi lệnh in (spooler) chạy song song, GUI không bị treo.
+        # Tiến độ ghi vào job_state.json -> tắt máy/hủy giữa chừng vẫn in tiếp được.
+        self.print_cancel = threading.Event()
+        self._render_failed = False
+        if PROFILER.enabled: PROFILER.reset()
+        self.spooler = PrintSpooler(default_backend(os.path.join("temp_batch_final", "spool")))
+        start_print_thread(self.snapshot(), job.indices, self.spooler, workers=os.cpu_count() or 1,
+                           cancel=self.print_cancel, job=job)
+        self.progress_bar.config(maximum=max(1, len(job.indices)), value=job.cards_done())
+        self.progress_frame.pack(fill=tk.X, pady=(0, 5), after=self.lbl_status)
+        self._poll_spooler()
+
+    def cancel_batch_print(self):
+        if self.print_cancel is None or self.print_cancel.is_set(): return
+        self.print_cancel.set()
+        self.spooler.drop_pending()
+        self.lbl_status.config(text="Đang hủy...")
+
+    @staticmethod
+    def _format_eta(seconds):
+        if seconds is None: return "--:--"
+        m, s = divmod(int(seconds), 60)
+        return f"{m // 60}:{m % 60:02d}:{s:02d}" if m >= 60 else f"{m}:{s:02d}"
+
+    def _poll_spooler(self):
+        self.spooler.drain_events(self._on_spool_event)
+        if self.spooler.is_alive() or not self.spooler.events.empty():
+            self.root.after(200, self._poll_spooler)
+
+    def _on_spool_event(self, kind, data):
+        if kind == "rendered":
+            self.progress_bar.config(value=data["done"])
+            text = (f"Đang render: {data['done']}/{data['total']} - "
+                    f"{data['rate']:.1f} thẻ/s - còn {self._format_eta(data['eta'])}")
+            if PROFILER.enabled: text += "\n" + PROFILER.status_line()
+            self.lbl_status.config(text=text)
+        elif kind == "spooled":
+            self.lbl_status.config(text=f"Đã gửi in: {os.path.basename(data['path'])}")
+        elif kind == "retry":
+            self.lbl_status.config(text=f"Lỗi máy in, thử lại lần {data['attempt'] + 1}...")
+        elif kind == "failed":
+            print(f"Print error: {data['error']}")
+        elif kind == "render_error":
+            self._render_failed = True
+            messagebox.showerror("Lỗi", f"Lỗi khi render: {data['error']}")
+        elif kind == "closed":
+            self.progress_frame.pack_forget()
+            self.lbl_status.config(text="")
+            if PROFILER.enabled:
+                # GUI chạy bằng pythonw không có console -> số liệu đầy đủ ghi ra file, tóm tắt lên thanh trạng thái
+                path = PROFILER.jsonl_path or os.path.join("temp_batch_final", "profile.jsonl")
+                PROFILER.export_jsonl(path)
+                self.lbl_status.config(text=f"{PROFILER.status_line()}\nChi tiết: {os.path.abspath(path)}")
+            if self.print_cancel.is_set():
+                messagebox.showinfo("Đã hủy", f"Đã dừng in ({data['spooled']} lệnh in đã gửi).\n"
+                                              "Bấm IN NGAY để in tiếp phần còn lại.")
+            elif self._render_failed:
+                # Lỗi render đã báo ở trên, job_state.json vẫn giữ phần chưa in
+                messagebox.showwarning("Chưa xong", f"Dừng in do lỗi render ({data['spooled']} lệnh in đã gửi).\n"
+                                                    "Sửa lỗi rồi bấm IN NGAY để in tiếp phần còn lại.")
+            elif data["failed"]:
+                messagebox.showerror("Lỗi", f"{data['failed']} lệnh in bị lỗi.")
+            else:
+                messagebox.showinfo("Xong", "Đã gửi lệnh in.")
+
     def exit_app(self):
         # Hiển thị hộp thoại xác nhận
         if messagebox.askyesno("Xác nhận", "Bạn có chắc chắn muốn thoát chương trình không?"):
+            self.config_writer.flush()
             self.root.destroy() # Lệnh đóng cửa sổ chính
 if __name__ == "__main__":
     root = tk.Tk()
     app = VoterAppV12Final(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
+    app.config_writer.flush() # Ghi nốt thay đổi còn chờ nếu đóng cửa sổ bằng nút X
\ No newline at end of file
@@ -0,0 +1,258 @@
+"""
+Nhúng font TrueType vào PDF cho chế độ chữ vector (VectorPdfWriter):
+đọc cmap/hmtx để đổi chữ (kể cả tiếng Việt có dấu) thành glyph id, rồi cắt font chỉ còn
+các glyph đã dùng (giữ nguyên glyph id, glyph không dùng để rỗng) - không cần fontTools.
+Font được ghi dạng Type0 / CIDFontType2, Identity-H, kèm ToUnicode để copy/tìm chữ trong PDF.
+"""
+import hashlib
+import os
+import re
+import struct
+import unicodedata
+import zlib
+
+# Bảng cần cho CIDFontType2 (PDF 1.7, 9.9) - các bảng còn lại (cmap, name, post, OS/2...) bỏ đi
+SUBSET_TABLES = ("head", "hhea", "maxp", "loca", "glyf", "hmtx", "cvt ", "fpgm", "prep")
+
+
+def _checksum(data):
+    data += b"\0" * (-len(data) % 4)
+    return sum(struct.unpack(f">{len(data) // 4}L", data)) & 0xFFFFFFFF
+
+
+class TrueTypeFont:
+    """Đọc 1 file .ttf (không hỗ trợ .ttc / CFF-OpenType)."""
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.data = f.read()
+        version, num_tables = struct.unpack(">LH", self.data[:6])
+        if version not in (0x00010000, 0x74727565):
+            raise ValueError(f"Không phải font TrueType (glyf): {path}")
+        self.tables = {}
+        for i in range(num_tables):
+            tag, _, offset, length = struct.unpack(">4sLLL", self.data[12 + 16 * i:28 + 16 * i])
+            self.tables[tag.decode("latin-1")] = (offset, length)
+
+        head = self.table("head")
+        self.units_per_em = struct.unpack(">H", head[18:20])[0]
+        self.bbox = struct.unpack(">4h", head[36:44])
+        self.index_to_loc = struct.unpack(">h", head[50:52])[0]
+        self.num_glyphs = struct.unpack(">H", self.table("maxp")[4:6])[0]
+        hhea = self.table("hhea")
+        self.ascent, self.descent = struct.unpack(">hh", hhea[4:8])
+        num_hmetrics = struct.unpack(">H", hhea[34:36])[0]
+
+        hmtx = self.table("hmtx")
+        advances = [struct.unpack(">H", hmtx[4 * i:4 * i + 2])[0] for i in range(num_hmetrics)]
+        self.advances = advances + [advances[-1]] * (self.num_glyphs - num_hmetrics)
+        self.cmap = self._read_cmap()
+        self.name = self._read_name()
+
+    def table(self, tag):
+        offset, length = self.tables[tag]
+        return self.data[offset:offset + length]
+
+    # ----------------------------------------------------------------
+    # CMAP / NAME
+    # ----------------------------------------------------------------
+    def _read_cmap(self):
+        cmap = self.table("cmap")
+        n = struct.unpack(">H", cmap[2:4])[0]
+        subtables = {}
+        for i in range(n):
+            pid, eid, offset = struct.unpack(">HHL", cmap[4 + 8 * i:12 + 8 * i])
+            subtables[(pid, eid)] = offset
+        for key in ((3, 10), (0, 4), (3, 1), (0, 3), (0, 1), (0, 0)):
+            if key not in subtables: continue
+            offset = subtables[key]
+            fmt = struct.unpack(">H", cmap[offset:offset + 2])[0]
+            if fmt == 12: return self._cmap12(cmap, offset)
+            if fmt == 4: return self._cmap4(cmap, offset)
+        raise ValueError(f"Font không có bảng cmap Unicode: {self.path}")
+
+    @staticmethod
+    def _cmap4(cmap, offset):
+        seg_x2 = struct.unpack(">H", cmap[offset + 6:offset + 8])[0]
+        seg = seg_x2 // 2
+        base = offset + 14
+        ends = struct.unpack(f">{seg}H", cmap[base:base + seg_x2])
+        starts = struct.unpack(f">{seg}H", cmap[base + seg_x2 + 2:base + 2 * seg_x2 + 2])
+        deltas = struct.unpack(f">{seg}h", cmap[base + 2 * seg_x2 + 2:base + 3 * seg_x2 + 2])
+        ro_base = base + 3 * seg_x2 + 2
+        range_offsets = struct.unpack(f">{seg}H", cmap[ro_base:ro_base + seg_x2])
+        out = {}
+        for i in range(seg):
+            if starts[i] == 0xFFFF: continue
+            for c in range(starts[i], ends[i] + 1):
+                if range_offsets[i] == 0:
+                    gid = (c + deltas[i]) & 0xFFFF
+                else:
+                    p = ro_base + 2 * i + range_offsets[i] + 2 * (c - starts[i])
+                    gid = struct.unpack(">H", cmap[p:p + 2])[0]
+                    if gid: gid = (gid + deltas[i]) & 0xFFFF
+                if gid: out[c] = gid
+        return out
+
+    @staticmethod
+    def _cmap12(cmap, offset):
+        n = struct.unpack(">L", cmap[offset + 12:offset + 16])[0]
+        out = {}
+        for i in range(n):
+            start, end, gid = struct.unpack(">LLL", cmap[offset + 16 + 12 * i:offset + 28 + 12 * i])
+            for c in range(start, end + 1):
+                out[c] = gid + c - start
+        return out
+
+    def _read_name(self):
+        """Tên PostScript (nameID 6), không có thì lấy theo tên file."""
+        if "name" in self.tables:
+            name = self.table("name")
+            count, string_base = struct.unpack(">HH", name[2:6])
+            for i in range(count):
+                pid, eid, _, nid, length, offset = struct.unpack(">6H", name[6 + 12 * i:18 + 12 * i])
+                if nid != 6: continue
+                raw = name[string_base + offset:string_base + offset + length]
+                text = raw.decode("utf-16-be" if pid in (0, 3) else "latin-1", errors="ignore")
+                if text: return re.sub(r"[^A-Za-z0-9+-]", "", text)
+        return re.sub(r"[^A-Za-z0-9+-]", "", os.path.splitext(os.path.basename(self.path))[0]) or "Font"
+
+    # ----------------------------------------------------------------
+    # GLYPHS
+    # ----------------------------------------------------------------
+    def _glyph_range(self, loca, gid):
+        if self.index_to_loc == 0:
+            a, b = struct.unpack(">HH", loca[2 * gid:2 * gid + 4])
+            return 2 * a, 2 * b
+        return struct.unpack(">LL", loca[4 * gid:4 * gid + 8])
+
+    def _components(self, glyph):
+        """Glyph id các thành phần của glyph ghép (chữ có dấu thường là glyph ghép)."""
+        if len(glyph) < 10 or struct.unpack(">h", glyph[:2])[0] >= 0: return []
+        out, p = [], 10
+        while True:
+            flags, gid = struct.unpack(">HH", glyph[p:p + 4])
+            out.append(gid)
+            p += 4 + (4 if flags & 0x0001 else 2)
+            if flags & 0x0008: p += 2
+            elif flags & 0x0040: p += 4
+            elif flags & 0x0080: p += 8
+            if not flags & 0x0020: return out
+
+    def subset(self, gids):
+        """Bytes font TrueType chỉ chứa các glyph gids (+ glyph 0 và thành phần glyph ghép)."""
+        loca, glyf = self.table("loca"), self.table("glyf")
+        keep, todo = set(), [0] + list(gids)
+        while todo:
+            gid = todo.pop()
+            if gid in keep or gid >= self.num_glyphs: continue
+            keep.add(gid)
+            a, b = self._glyph_range(loca, gid)
+            todo.extend(self._components(glyf[a:b]))
+
+        new_glyf, offsets = bytearray(), []
+        for gid in range(self.num_glyphs):
+            offsets.append(len(new_glyf))
+            if gid in keep:
+                a, b = self._glyph_range(loca, gid)
+                new_glyf += glyf[a:b]
+                new_glyf += b"\0" * (-len(new_glyf) % 4)
+        offsets.append(len(new_glyf))
+
+        head = bytearray(self.table("head"))
+        head[8:12] = b"\0\0\0\0"  # checkSumAdjustment
+        head[50:52] = struct.pack(">h", 1)  # loca dạng 32-bit
+        tables = {"head": bytes(head), "glyf": bytes(new_glyf),
+                  "loca": struct.pack(f">{len(offsets)}L", *offsets)}
+        for tag in SUBSET_TABLES:
+            if tag not in tables and tag in self.tables:
+                tables[tag] = self.table(tag)
+        return self._pack(tables)
+
+    @staticmethod
+    def _pack(tables):
+        tags = sorted(tables)
+        n = len(tags)
+        entry_selector = max(i for i in range(16) if 2 ** i <= n)
+        search_range = 16 * 2 ** entry_selector
+        out = bytearray(struct.pack(">LHHHH", 0x00010000, n, search_range, entry_selector, n * 16 - search_range))
+        offset = 12 + 16 * n
+        body = bytearray()
+        for tag in tags:
+            data = tables[tag]
+            out += struct.pack(">4sLLL", tag.encode("latin-1"), _checksum(data), offset + len(body), len(data))
+            body += data + b"\0" * (-len(data) % 4)
+        return bytes(out + body)
+
+
+class PdfFont:
+    """
+    1 font đã dùng trong file PDF: ghi nhận glyph theo từng đoạn chữ (encode),
+    cuối cùng ghi Type0 + CIDFontType2 + FontDescriptor + font subset + ToUnicode (write).
+    """
+    def __init__(self, path, res="F1", oid=None):
+        self.ttf = TrueTypeFont(path)
+        self.res = res  # tên trong /Resources của trang
+        self.oid = oid  # object id của font Type0 (cấp trước, ghi lúc đóng file)
+        self.used = {}  # gid -> chuỗi unicode (cho ToUnicode)
+
+    def encode(self, text):
+        """(chuỗi hex cho toán tử Tj, độ rộng theo đơn vị em) của text."""
+        text = unicodedata.normalize("NFC", text)
+        gids = []
+        for ch in text:
+            gid = self.ttf.cmap.get(ord(ch), 0)
+            gids.append(gid)
+            self.used.setdefault(gid, ch)
+        width = sum(self.ttf.advances[g] for g in gids) / self.ttf.units_per_em
+        return "".join(f"{g:04X}" for g in gids), width
+
+    def baseline_offset(self):
+        """Khoảng từ đường giữa (anchor "m" của PIL) xuống baseline, theo đơn vị em."""
+        return (self.ttf.ascent + self.ttf.descent) / 2 / self.ttf.units_per_em
+
+    def write(self, writer):
+        ttf = self.ttf
+        scale = 1000.0 / ttf.units_per_em
+        tag = "".join(chr(65 + b % 26) for b in hashlib.md5(repr(sorted(self.used)).encode()).digest()[:6])
+        name = f"{tag}+{ttf.name}"
+
+        data = ttf.subset(self.used)
+        packed = zlib.compress(data, 9)
+        file_id, desc_id, cid_id, tu_id = writer._alloc(), writer._alloc(), writer._alloc(), writer._alloc()
+        writer._write_obj(file_id, f"<< /Length {len(packed)} /Length1 {len(data)} /Filter /FlateDecode >>", packed)
+
+        bbox = " ".join(str(round(v * scale)) for v in ttf.bbox)
+        writer._write_obj(desc_id, (
+            f"<< /Type /FontDescriptor /FontName /{name} /Flags 32 /FontBBox [{bbox}] /ItalicAngle 0 "
+            f"/Ascent {round(ttf.ascent * scale)} /Descent {round(ttf.descent * scale)} "
+            f"/CapHeight {round(ttf.ascent * scale)} /StemV 80 /FontFile2 {file_id} 0 R >>"
+        ))
+        widths = " ".join(f"{g} [{round(ttf.advances[g] * scale)}]" for g in sorted(self.used))
+        writer._write_obj(cid_id, (
+            f"<< /Type /Font /Subtype /CIDFontType2 /BaseFont /{name} "
+            f"/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> "
+            f"/FontDescriptor {desc_id} 0 R /CIDToGIDMap /Identity /W [{widths}] >>"
+        ))
+
+        cmap = self._to_unicode().encode("latin-1")
+        writer._write_obj(tu_id, f"<< /Length {len(cmap)} >>", cmap)
+        writer._write_obj(self.oid, (
+            f"<< /Type /Font /Subtype /Type0 /BaseFont /{name} /Encoding /Identity-H "
+            f"/DescendantFonts [{cid_id} 0 R] /ToUnicode {tu_id} 0 R >>"
+        ))
+
+    def _to_unicode(self):
+        entries = [(g, ch) for g, ch in sorted(self.used.items()) if g]
+        lines = ["/CIDInit /ProcSet findresource begin", "12 dict begin", "begincmap",
+                 "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def",
+                 "/CMapName /Adobe-Identity-UCS def", "/CMapType 2 def",
+                 "1 begincodespacerange", "<0000> <FFFF>", "endcodespacerange"]
+        for i in range(0, len(entries), 100):
+            chunk = entries[i:i + 100]
+            lines.append(f"{len(chunk)} beginbfchar")
+            for g, ch in chunk:
+                lines.append(f"<{g:04X}> <{ch.encode('utf-16-be').hex().upper()}>")
+            lines.append("endbfchar")
+        lines += ["endcmap", "CMapName currentdict /CMap defineresource pop", "end", "end"]
+        return "\n".join(lines)
@@ -0,0 +1,240 @@
+"""
+Ghi nhiều thẻ vào 1 file PDF nhiều trang, kiểu streaming:
+mỗi trang được ghi xuống đĩa ngay khi render xong, bộ nhớ chỉ giữ offset của các object.
+
+- PdfBatchWriter: mỗi trang là 1 ảnh JPEG đã render sẵn.
+- VectorPdfWriter: phôi nhúng 1 lần dùng chung cho mọi trang, chữ ghi dạng vector (font subset).
+"""
+import io
+import zlib
+
+from pdf_fonts import PdfFont
+
+
+class PdfBatchWriter:
+    """
+    Writer PDF tối giản: mỗi trang là 1 ảnh JPEG (DCTDecode) phủ kín trang.
+
+        with PdfBatchWriter("batch.pdf") as pdf:
+            for img in cards:
+                pdf.add_page(img)
+    """
+    def __init__(self, path, dpi=None, quality=90):
+        self.path = path
+        self.dpi = dpi
+        self.quality = quality
+        self.page_count = 0
+
+        self._f = open(path, "wb")
+        self._offsets = {}
+        self._page_ids = []
+        self._next_id = 3  # 1 = Catalog, 2 = Pages (ghi lúc close)
+        self._f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    # ----------------------------------------------------------------
+    # LOW LEVEL
+    # ----------------------------------------------------------------
+    def _alloc(self):
+        oid = self._next_id
+        self._next_id += 1
+        return oid
+
+    def _write_obj(self, oid, body, stream=None):
+        self._offsets[oid] = self._f.tell()
+        self._f.write(f"{oid} 0 obj\n".encode())
+        self._f.write(body.encode("latin-1") if isinstance(body, str) else body)
+        if stream is not None:
+            self._f.write(b"\nstream\n")
+            self._f.write(stream)
+            self._f.write(b"\nendstream")
+        self._f.write(b"\nendobj\n")
+
+    # ----------------------------------------------------------------
+    # PAGES
+    # ----------------------------------------------------------------
+    def add_page(self, img, dpi=None):
+        """Encode ảnh PIL thành JPEG rồi ghi thành 1 trang."""
+        data, width, height, img_dpi = encode_jpeg(img, self.quality)
+        self.add_jpeg(data, width, height, dpi or self.dpi or img_dpi)
+
+    def add_jpeg(self, data, width, height, dpi=72):
+        """Ghi 1 trang từ JPEG đã encode sẵn (vd: encode trong process con)."""
+        pw, ph = width * 72.0 / dpi, height * 72.0 / dpi
+        img_id, content_id, page_id = self._alloc(), self._alloc(), self._alloc()
+
+        self._write_obj(img_id, (
+            f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode /Length {len(data)} >>"
+        ), data)
+        content = f"q {pw:.2f} 0 0 {ph:.2f} 0 0 cm /Im0 Do Q".encode()
+        self._write_obj(content_id, f"<< /Length {len(content)} >>", content)
+        self._write_obj(page_id, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {pw:.2f} {ph:.2f}] "
+            f"/Resources << /XObject << /Im0 {img_id} 0 R >> >> /Contents {content_id} 0 R >>"
+        ))
+        self._page_ids.append(page_id)
+        self.page_count += 1
+        self._f.flush()
+
+    # ----------------------------------------------------------------
+    # FINISH
+    # ----------------------------------------------------------------
+    def close(self):
+        if self._f.closed: return
+        self._finish()
+        kids = " ".join(f"{pid} 0 R" for pid in self._page_ids)
+        self._write_obj(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>")
+        self._write_obj(1, "<< /Type /Catalog /Pages 2 0 R >>")
+
+        xref_pos = self._f.tell()
+        size = self._next_id
+        self._f.write(f"xref\n0 {size}\n0000000000 65535 f \n".encode())
+        for oid in range(1, size):
+            self._f.write(f"{self._offsets.get(oid, 0):010d} 00000 n \n".encode())
+        self._f.write(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_pos}\n%%EOF\n".encode())
+        self._f.close()
+
+    def _finish(self):
+        """Ghi các object dùng chung còn treo (font...) trước Pages / xref."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class VectorPage:
+    """
+    Nội dung 1 trang vector. Toạ độ tính theo pixel như khi vẽ bằng PIL (gốc trên-trái,
+    ở dpi của trang), được đổi sang điểm PDF bằng 1 ma trận cm đầu trang.
+    """
+    def __init__(self, width, height, dpi=72):
+        self.width, self.height, self.dpi = width, height, dpi
+        k = 72.0 / dpi
+        self.ops = [f"{k:.6f} 0 0 {k:.6f} 0 0 cm"]
+        self.xobjects = {}
+        self.fonts = {}
+
+    def image(self, xobj, x, y, w, h):
+        """Vẽ ảnh đã nhúng (res, oid) vào hộp (x, y, w, h)."""
+        res, oid = xobj
+        self.xobjects[res] = oid
+        self.ops.append(f"q {w:.2f} 0 0 {h:.2f} {x:.2f} {self.height - y - h:.2f} cm /{res} Do Q")
+
+    def text(self, font, size, x, y, text, color=(0, 0, 0)):
+        """Chữ căn giữa quanh (x, y) - tương đương anchor="mm" của PIL."""
+        if not text: return
+        hexstr, em = font.encode(text)
+        self.fonts[font.res] = font.oid
+        x0, baseline = x - em * size / 2, y + font.baseline_offset() * size
+        r, g, b = (c / 255 for c in color[:3])
+        self.ops.append(f"BT {r:.3f} {g:.3f} {b:.3f} rg /{font.res} {size:.2f} Tf "
+                        f"{x0:.2f} {self.height - baseline:.2f} Td <{hexstr}> Tj ET")
+
+    def line(self, x1, y1, x2, y2, width=1):
+        self.ops.append(f"q {width} w 0 G {x1:.2f} {self.height - y1:.2f} m {x2:.2f} {self.height - y2:.2f} l S Q")
+
+    def content(self):
+        return zlib.compress("\n".join(self.ops).encode("latin-1"))
+
+
+class VectorPdfWriter(PdfBatchWriter):
+    """
+    Writer PDF dạng vector: ảnh (phôi, chữ ký) nhúng 1 lần theo key rồi tham chiếu lại ở mọi trang,
+    font TrueType chỉ nhúng các glyph đã dùng (ghi lúc close).
+
+        with VectorPdfWriter("batch.pdf") as pdf:
+            page = pdf.new_page(w, h, dpi)
+            page.image(pdf.image("tpl", template_img), 0, 0, w, h)
+            page.text(pdf.font(ttf_path), 30, x, y, "NGUYỄN VĂN A")
+            pdf.add_vector_page(page)
+    """
+    def __init__(self, path, dpi=None, quality=90):
+        super().__init__(path, dpi, quality)
+        self._images = {}  # key -> (res, oid)
+        self._fonts = {}   # đường dẫn .ttf -> PdfFont
+
+    def new_page(self, width, height, dpi=72):
+        return VectorPage(width, height, dpi)
+
+    def font(self, path):
+        font = self._fonts.get(path)
+        if font is None:
+            font = self._fonts[path] = PdfFont(path, f"F{len(self._fonts) + 1}", self._alloc())
+        return font
+
+    def image(self, key, img, source=None):
+        """
+        Nhúng ảnh PIL 1 lần cho mỗi key. source: file JPEG gốc (RGB/xám) thì nhúng thẳng bytes,
+        không decode/encode lại. Ảnh có alpha (chữ ký PNG) được ghi kèm SMask.
+        """
+        xobj = self._images.get(key)
+        if xobj is None:
+            xobj = self._images[key] = (f"Im{len(self._images) + 1}", self._write_image(img, source))
+        return xobj
+
+    def _write_image(self, img, source=None):
+        oid = self._alloc()
+        head = f"/Type /XObject /Subtype /Image /Width {img.width} /Height {img.height} /BitsPerComponent 8"
+        if source:
+            from PIL import Image
+            with Image.open(source) as im:
+                fmt, mode, size = im.format, im.mode, im.size
+        if source and fmt == "JPEG" and mode in ("RGB", "L") and size == img.size:
+            with open(source, "rb") as f:
+                data = f.read()
+            space = "/DeviceRGB" if mode == "RGB" else "/DeviceGray"
+            self._write_obj(oid, f"<< {head} /ColorSpace {space} /Filter /DCTDecode /Length {len(data)} >>", data)
+            return oid
+
+        smask = ""
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            alpha = zlib.compress(img.getchannel("A").tobytes())
+            mask_id = self._alloc()
+            self._write_obj(mask_id, (
+                f"<< /Type /XObject /Subtype /Image /Width {img.width} /Height {img.height} /BitsPerComponent 8 "
+                f"/ColorSpace /DeviceGray /Filter /FlateDecode /Length {len(alpha)} >>"
+            ), alpha)
+            smask = f" /SMask {mask_id} 0 R"
+        data = zlib.compress(img.convert("RGB").tobytes())
+        self._write_obj(oid, f"<< {head} /ColorSpace /DeviceRGB{smask} /Filter /FlateDecode /Length {len(data)} >>", data)
+        return oid
+
+    def add_vector_page(self, page):
+        k = 72.0 / page.dpi
+        pw, ph = page.width * k, page.height * k
+        content_id, page_id = self._alloc(), self._alloc()
+        content = page.content()
+        self._write_obj(content_id, f"<< /Length {len(content)} /Filter /FlateDecode >>", content)
+        xobjects = " ".join(f"/{res} {oid} 0 R" for res, oid in page.xobjects.items())
+        fonts = " ".join(f"/{res} {oid} 0 R" for res, oid in page.fonts.items())
+        self._write_obj(page_id, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {pw:.2f} {ph:.2f}] "
+            f"/Resources << /XObject << {xobjects} >> /Font << {fonts} >> >> /Contents {content_id} 0 R >>"
+        ))
+        self._page_ids.append(page_id)
+        self.page_count += 1
+        self._f.flush()
+
+    def _finish(self):
+        for font in self._fonts.values():
+            font.write(self)
+
+
+def encode_jpeg(img, quality=90):
+    """(bytes, width, height, dpi) - dạng gọn để gửi từ process con về writer."""
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    dpi = img.info.get("dpi", (72, 72))[0] or 72
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=quality, dpi=(dpi, dpi))
+    return buf.getvalue(), img.width, img.height, dpi
+
+
+def jpeg_page(data):
+    """(bytes, width, height, dpi) từ JPEG đã encode sẵn (vd: đọc lại từ cache) - chỉ đọc header."""
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as im:
+        return data, im.width, im.height, im.info.get("dpi", (72, 72))[0] or 72
@@ -0,0 +1,198 @@
+"""
+Đo thời gian từng bước của pipeline render (bật khi cần, tắt thì gần như không tốn gì).
+
+    from profiling import PROFILER
+    with PROFILER.stage("text_draw"):
+        draw.text(...)
+
+Bật bằng biến môi trường VOTER_PROFILE=1 (hoặc VOTER_PROFILE=duong_dan.jsonl để ghi JSON lines),
+hoặc --profile của CLI render_engine.py. Khi tắt, stage() trả về 1 context manager rỗng dùng chung.
+"""
+import json
+import os
+import threading
+import time
+
+# Các bước bao trùm bước khác (không tính khi xếp hạng bước tốn thời gian)
+OUTER_STAGES = ("batch", "page", "card")
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ("profiler", "name", "t0")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, time.perf_counter() - self.t0)
+        return False
+
+
+class Profiler:
+    """
+    Bộ đếm dùng chung cho cả process: stage (tổng/số lần/max thời gian), counter, và tỉ lệ trúng
+    của các cache đã đăng ký (register_cache). Process con gửi phần tăng thêm về bằng take()/merge().
+    """
+    def __init__(self):
+        self.enabled = False
+        self.jsonl_path = None
+        self._lock = threading.Lock()
+        self.reset()
+        self._caches = {}
+
+    def enable(self, jsonl_path=None):
+        self.enabled = True
+        self.jsonl_path = jsonl_path or self.jsonl_path
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}    # name -> [tổng giây, số lần, max giây]
+            self.counters = {}
+            self.child_caches = {}  # pid -> cache_stats() mới nhất của process con
+            self.started = time.perf_counter()
+
+    # ----------------------------------------------------------------
+    # GHI NHẬN
+    # ----------------------------------------------------------------
+    def stage(self, name):
+        return _Stage(self, name) if self.enabled else _NULL_STAGE
+
+    def add(self, name, seconds, calls=1):
+        with self._lock:
+            s = self.stages.get(name)
+            if s is None:
+                self.stages[name] = [seconds, calls, seconds]
+            else:
+                s[0] += seconds
+                s[1] += calls
+                if seconds > s[2]: s[2] = seconds
+
+    def count(self, name, n=1):
+        if not self.enabled: return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def register_cache(self, name, stats):
+        """stats() -> dict có "hits" và "misses" (FontCache, ScaledSignatureCache, CardCache...)."""
+        self._caches[name] = stats
+
+    # ----------------------------------------------------------------
+    # PROCESS CON
+    # ----------------------------------------------------------------
+    def take(self):
+        """Số liệu từ lần take() trước (process con gửi kèm kết quả), None nếu đang tắt."""
+        if not self.enabled: return None
+        with self._lock:
+            data = {"pid": os.getpid(), "stages": self.stages, "counters": self.counters,
+                    "caches": self._own_cache_stats()}
+            self.stages, self.counters = {}, {}
+        return data
+
+    def merge(self, data):
+        if not data: return
+        with self._lock:
+            for name, (total, calls, peak) in data["stages"].items():
+                s = self.stages.setdefault(name, [0.0, 0, 0.0])
+                s[0] += total
+                s[1] += calls
+                s[2] = max(s[2], peak)
+            for name, n in data["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            # Số liệu cache là lũy kế -> giữ bản mới nhất của từng process con
+            self.child_caches[data["pid"]] = data["caches"]
+
+    # ----------------------------------------------------------------
+    # XUẤT
+    # ----------------------------------------------------------------
+    def _own_cache_stats(self):
+        out = {}
+        for name, stats in self._caches.items():
+            s = stats()
+            out[name] = {"hits": s.get("hits", 0), "misses": s.get("misses", 0)}
+        return out
+
+    def cache_stats(self):
+        out = self._own_cache_stats()
+        for caches in list(self.child_caches.values()):
+            for name, s in caches.items():
+                o = out.setdefault(name, {"hits": 0, "misses": 0})
+                o["hits"] += s["hits"]
+                o["misses"] += s["misses"]
+        for s in out.values():
+            total = s["hits"] + s["misses"]
+            s["hit_rate"] = s["hits"] / total if total else None
+        return out
+
+    def snapshot(self):
+        with self._lock:
+            stages = {k: {"total_ms": v[0] * 1000, "calls": v[1], "mean_ms": v[0] * 1000 / v[1] if v[1] else 0,
+                          "max_ms": v[2] * 1000} for k, v in self.stages.items()}
+            counters = dict(self.counters)
+        return {"elapsed_s": time.perf_counter() - self.started, "stages": stages,
+                "counters": counters, "caches": self.cache_stats()}
+
+    def summary(self):
+        snap = self.snapshot()
+        lines = [f"{'bước':<18}{'tổng ms':>11}{'lần':>9}{'tb ms':>9}{'max ms':>9}"]
+        for name, s in sorted(snap["stages"].items(), key=lambda kv: -kv[1]["total_ms"]):
+            lines.append(f"{name:<18}{s['total_ms']:>11.1f}{s['calls']:>9}{s['mean_ms']:>9.3f}{s['max_ms']:>9.1f}")
+        for name, n in sorted(snap["counters"].items()):
+            lines.append(f"{name:<18}{n:>11}")
+        for name, s in sorted(snap["caches"].items()):
+            rate = f"{s['hit_rate']:.1%}" if s["hit_rate"] is not None else "-"
+            lines.append(f"cache {name:<12} trúng {rate} ({s['hits']}/{s['hits'] + s['misses']})")
+        return "\n".join(lines)
+
+    def status_line(self, top=3):
+        """Chuỗi ngắn cho thanh trạng thái GUI: thẻ/giây, các bước tốn nhất (ms/thẻ), tỉ lệ trúng cache."""
+        snap = self.snapshot()
+        cards = snap["counters"].get("cards", 0)
+        parts = [f"{cards / snap['elapsed_s']:.1f} thẻ/s"] if cards and snap["elapsed_s"] else []
+        leaf = [(k, s) for k, s in snap["stages"].items() if k not in OUTER_STAGES]
+        for name, s in sorted(leaf, key=lambda kv: -kv[1]["total_ms"])[:top]:
+            per_card = s["total_ms"] / cards if cards else s["mean_ms"]
+            parts.append(f"{name} {per_card:.1f}ms")
+        parts += [f"cache {k} {s['hit_rate']:.0%}" for k, s in snap["caches"].items() if s["hit_rate"] is not None]
+        return " | ".join(parts)
+
+    def export_jsonl(self, path=None, run=None):
+        """Ghi thêm (append) mỗi stage / counter / cache thành 1 dòng JSON."""
+        path = path or self.jsonl_path
+        if not path: return
+        snap = self.snapshot()
+        base = {"run": run or time.strftime("%Y-%m-%dT%H:%M:%S"), "elapsed_s": snap["elapsed_s"]}
+        with open(path, "a", encoding="utf-8") as f:
+            for name, s in snap["stages"].items():
+                f.write(json.dumps({**base, "stage": name, **s}, ensure_ascii=False) + "\n")
+            for name, n in snap["counters"].items():
+                f.write(json.dumps({**base, "counter": name, "value": n}, ensure_ascii=False) + "\n")
+            for name, s in snap["caches"].items():
+                f.write(json.dumps({**base, "cache": name, **s}, ensure_ascii=False) + "\n")
+
+
+PROFILER = Profiler()
+
+_env = os.environ.get("VOTER_PROFILE", "")
+if _env and _env != "0":
+    PROFILER.enable(_env if _env.endswith(".jsonl") else None)
@@ -0,0 +1,1359 @@
+"""
+Engine render thẻ cử tri chạy headless (không cần Tk, không cần win32api).
+
+Dùng chung cho GUI (main.py) và cho dòng lệnh:
+    python render_engine.py --excel ds.xlsx --template phoi.jpg --out temp_batch_final
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from copy import deepcopy
+from functools import lru_cache
+from multiprocessing import shared_memory
+
+import pandas as pd
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+from card_cache import CARD_CACHE
+from data_loader import SHEET_CACHE, ColumnIndex, preformat_series
+from file_utils import atomic_write_text
+from imposition import ImpositionLayout, SheetImposer
+from pdf_output import PdfBatchWriter, VectorPdfWriter, encode_jpeg, jpeg_page
+from profiling import PROFILER
+from spooler import BACKENDS, JOB_STATE_FILE, FileSinkBackend, JobState, LpBackend, PrintSpooler, start_print_thread
+
+# ========================================================================================
+# CẤU HÌNH & HẰNG SỐ (CONSTANTS)
+# ========================================================================================
+CONFIG_FILE = "cau_hinh_v12_final.json"
+
+FONT_MAP = {
+    "Arial": {"normal": "arial.ttf", "bold": "arialbd.ttf"},
+    "Times New Roman": {"normal": "times.ttf", "bold": "timesbd.ttf"},
+    "Calibri": {"normal": "calibri.ttf", "bold": "calibrib.ttf"}
+}
+
+# Thư mục font thường gặp trên Linux (cài gói ttf-mscorefonts hoặc copy từ Windows)
+LINUX_FONT_DIRS = [
+    "/usr/share/fonts/truetype/msttcorefonts",
+    "/usr/share/fonts/truetype/ms-fonts",
+    "/usr/share/fonts/TTF",
+    os.path.expanduser("~/.fonts"),
+]
+
+# Font thay thế cho PDF vector khi không có file .ttf của font đã chọn (vd: Linux không cài font MS)
+VECTOR_FALLBACK_FONTS = {"normal": "DejaVuSans.ttf", "bold": "DejaVuSans-Bold.ttf"}
+
+SIGNATURE_EXTS = [".png", ".jpg", ".jpeg"]
+
+# Cột dùng cho danh sách cử tri / tìm chữ ký -> luôn nạp dù không bật trên thẻ
+# (so khớp không dấu, không phân biệt hoa thường - xem data_loader.ColumnIndex)
+ROLE_KEYWORDS = {
+    "name": ["Họ tên", "Họ và tên", "Full name", "Name"],
+    "gender": ["Giới tính", "Gender"],
+    "cccd": ["CCCD", "CMND", "Căn cước"],
+    "area": ["Khu vực", "Thôn", "Tổ dân phố"],
+}
+
+DEFAULT_SIGNATURE_CFG = {"x": 300, "y": 300, "w": 150, "h": 80, "enable": True, "type": "image"}
+
+
+# ========================================================================================
+# CONFIG HELPERS
+# ========================================================================================
+def load_config(path=CONFIG_FILE):
+    """Đọc file cấu hình (kèm journal chỉnh riêng nếu có), trả về (global_config, custom_configs)."""
+    global_config, custom_configs = {}, {}
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+                global_config = data.get("global", {})
+                custom_configs = {int(k): v for k, v in data.get("custom", {}).items()}
+        except Exception:
+            pass
+
+    # File .compacting còn sót lại = lần gộp trước bị ngắt -> replay trước journal hiện tại
+    for jp in (path + ".journal.compacting", path + ".journal"):
+        replay_journal(jp, custom_configs)
+
+    if "signature_img" not in global_config:
+        global_config["signature_img"] = dict(DEFAULT_SIGNATURE_CFG)
+    return global_config, custom_configs
+
+
+def replay_journal(journal_path, custom_configs):
+    """Mỗi dòng journal là cấu hình riêng đầy đủ của 1 người ({"idx", "cfg"}), cfg=null là đã reset."""
+    if not os.path.exists(journal_path): return
+    with open(journal_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                break  # dòng cuối ghi dở khi mất điện
+            if rec.get("cfg") is None:
+                custom_configs.pop(rec["idx"], None)
+            else:
+                custom_configs[rec["idx"]] = rec["cfg"]
+
+
+def dump_config(global_config, custom_configs):
+    data = {"global": global_config, "custom": custom_configs}
+    return json.dumps(data, ensure_ascii=False, indent=4)
+
+
+class ConfigWriter:
+    """
+    Ghi cấu hình kiểu write-behind: gom các thay đổi trong `delay` ms rồi ghi 1 lần.
+    - Sửa cấu hình chung -> ghi lại cả file (atomic).
+    - Chỉ sửa riêng từng người (use_journal=True) -> append vào <config>.journal,
+      đủ `compact_after` dòng thì gộp vào file chính ở thread nền.
+
+    scheduler(delay_ms, callback) phải gọi callback trên cùng thread đang sửa cấu hình
+    (GUI truyền root.after). Không có scheduler -> ghi ngay.
+    """
+    def __init__(self, engine, delay=400, scheduler=None, use_journal=True, compact_after=500):
+        self.engine = engine
+        self.delay = delay
+        self.scheduler = scheduler
+        self.use_journal = use_journal
+        self.compact_after = compact_after
+
+        self._pending = False
+        self._full = False
+        self._rows = set()
+        self._journal_lines = 0
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._written_seq = 0
+        self._compactor = None
+
+    @property
+    def path(self):
+        return self.engine.config_path
+
+    def mark_dirty(self, idx=None):
+        """idx=None: cấu hình chung đổi; idx=n: chỉ cấu hình riêng của dòng n đổi."""
+        if idx is None or not self.use_journal:
+            self._full = True
+        else:
+            self._rows.add(idx)
+
+        if self.scheduler is None:
+            self.flush()
+        elif not self._pending:
+            self._pending = True
+            self.scheduler(self.delay, self.flush)
+
+    def flush(self):
+        self._pending = False
+        if self._full:
+            self._write_full()
+        elif self._rows:
+            self._append_journal()
+        self._full = False
+        self._rows.clear()
+
+    def _write_full(self):
+        text = dump_config(self.engine.global_config, self.engine.custom_configs)
+        self._seq += 1
+        self._write_snapshot(self._seq, text)
+        self._journal_lines = 0
+
+    def _write_snapshot(self, seq, text, journals=(".journal", ".journal.compacting")):
+        with self._lock:
+            if seq <= self._written_seq: return  # đã có bản mới hơn ghi trước
+            atomic_write_text(self.path, text)
+            self._written_seq = seq
+            for suffix in journals:
+                try: os.remove(self.path + suffix)
+                except FileNotFoundError: pass
+
+    def _append_journal(self):
+        custom = self.engine.custom_configs
+        with open(self.path + ".journal", "a", encoding="utf-8") as f:
+            for idx in sorted(self._rows):
+                f.write(json.dumps({"idx": idx, "cfg": custom.get(idx)}, ensure_ascii=False) + "\n")
+        self._journal_lines += len(self._rows)
+        if self._journal_lines >= self.compact_after:
+            self.compact_async()
+
+    def compact_async(self):
+        """Chụp snapshot ngay trên thread hiện tại, ghi file chính ở thread nền."""
+        if self._compactor is not None and self._compactor.is_alive():
+            return  # lần gộp trước chưa xong, để lần append sau gộp tiếp
+        journal = self.path + ".journal"
+        with self._lock:
+            if os.path.exists(journal):
+                os.replace(journal, journal + ".compacting")
+        text = dump_config(self.engine.global_config, self.engine.custom_configs)
+        self._seq += 1
+        self._journal_lines = 0
+        self._compactor = threading.Thread(target=self._write_snapshot, daemon=True,
+                                           args=(self._seq, text, (".journal.compacting",)))
+        self._compactor.start()
+
+
+@lru_cache(maxsize=None)
+def get_font_path(font_name, is_bold):
+    style = "bold" if is_bold else "normal"
+    f_file = FONT_MAP.get(font_name, FONT_MAP["Arial"]).get(style, "arial.ttf")
+    if platform.system() == "Windows":
+        return os.path.join(os.environ["WINDIR"], "Fonts", f_file)
+
+    for d in LINUX_FONT_DIRS:
+        for name in (f_file, f_file.capitalize()):
+            p = os.path.join(d, name)
+            if os.path.exists(p): return p
+    return "arial.ttf"
+
+
+@lru_cache(maxsize=None)
+def get_vector_font_path(font_name, is_bold):
+    """File .ttf để nhúng vào PDF vector (cần file thật, không dùng được font mặc định của PIL)."""
+    p = get_font_path(font_name, is_bold)
+    if os.path.isfile(p) and p.lower().endswith(".ttf"): return p
+    fallback = VECTOR_FALLBACK_FONTS["bold" if is_bold else "normal"]
+    try:
+        return ImageFont.truetype(fallback, 10).path
+    except OSError:
+        raise RuntimeError(f"Không tìm thấy file font cho PDF vector: {font_name} / {fallback}")
+
+
+# Tham số vẽ đã resolve sẵn của 1 trường (bất biến, dùng trực tiếp khi render)
+FieldSpec = namedtuple("FieldSpec", "name kind enable x y size font bold upper color w h path")
+
+
+def compile_field(name, cfg):
+    return FieldSpec(
+        name=name,
+        kind="image" if name == "signature_img" else "text",
+        enable=bool(cfg.get("enable", False)),
+        x=cfg.get("x", 0), y=cfg.get("y", 0),
+        size=cfg.get("size", 30),
+        font=cfg.get("font", "Arial"),
+        bold=bool(cfg.get("bold", False)),
+        upper=bool(cfg.get("upper", False)),
+        color=cfg.get("color", "black"),
+        w=cfg.get("w", 150), h=cfg.get("h", 80),
+        path=cfg.get("path"),
+    )
+
+
+# ========================================================================================
+# CACHES
+# ========================================================================================
+class TemplateCache:
+    """
+    Giữ 1 bản phôi đã decode (RGB) theo (path, mtime), kèm các bản đã scale (in N-up).
+    Mỗi thẻ chỉ lấy bản copy, không phải decode lại JPG/PNG.
+    """
+    def __init__(self):
+        self._key = None
+        self._master = None
+        self._scaled = {}
+        self._shared = []  # SharedMemory đang attach (process con) - giữ đến hết process
+
+    def master(self, path):
+        key = (path, os.path.getmtime(path))
+        if key != self._key:
+            with Image.open(path) as im:
+                self._master = im.convert("RGB")
+            self._key = key
+            self._scaled = {}
+        return self._master
+
+    def scaled(self, path, scale):
+        master = self.master(path)
+        if scale == 1.0: return master
+        img = self._scaled.get(scale)
+        if img is None:
+            size = (max(1, round(master.width * scale)), max(1, round(master.height * scale)))
+            img = self._scaled[scale] = master.resize(size, Image.Resampling.LANCZOS)
+        return img
+
+    def get(self, path, scale=1.0):
+        img = self.scaled(path, scale)
+        # Bản trong shared memory là RGBX -> convert chính là bản copy để vẽ
+        return img.copy() if img.mode == "RGB" else img.convert("RGB")
+
+    def invalidate(self):
+        self._key = None
+        self._master = None
+        self._scaled = {}
+
+    def share(self, path, scales=(1.0,), layers=None):
+        """
+        Đặt phôi (và các bản scale cần dùng) vào shared memory cho các process con.
+        layers: thêm các lớp nền đã vẽ sẵn trường tĩnh (RenderEngine._static_layers) nếu có.
+        """
+        images = {s: self.scaled(path, s) for s in {1.0, *scales}}
+        return SharedTemplate((path, os.path.getmtime(path)), images, layers)
+
+    def attach(self, handle):
+        """
+        Process con: bọc phôi trong shared memory của process chính (không decode, không copy).
+        Trả về các lớp nền dùng chung (key -> ảnh) cho RenderEngine._static_layers.
+        """
+        images = {scale: self._wrap(block, handle) for scale, block in handle["images"].items()}
+        self._key, self._master, self._scaled = handle["key"], images[1.0], images
+        return {key: self._wrap(block, handle) for key, block in handle["layers"].items()}
+
+    def _wrap(self, block, handle):
+        name, size = block
+        shm = shared_memory.SharedMemory(name=name)
+        self._shared.append(shm)
+        img = Image.frombuffer("RGBX", size, shm.buf[:size[0] * size[1] * 4], "raw", "RGBX", 0, 1)
+        img.info.update(handle["info"])
+        return img
+
+
+class SharedTemplate:
+    """
+    Phôi đã decode đặt 1 lần trong shared memory, dạng RGBX (4 byte/pixel - dạng Image.frombuffer
+    bọc được trực tiếp), để N process con không phải mỗi process giữ 1 bản phôi full-res.
+    Process chính giữ và giải phóng (with ...); process con nhận handle qua _init_worker.
+    """
+    def __init__(self, key, images, layers=None):
+        self.blocks = []
+        self.handle = {"key": key, "info": {}, "images": {}, "layers": {}}
+        try:
+            for scale, img in images.items():
+                if "dpi" in img.info: self.handle["info"]["dpi"] = img.info["dpi"]
+                self.handle["images"][scale] = self._put(img)
+            for key, img in (layers or {}).items():
+                self.handle["layers"][key] = self._put(img)
+        except BaseException:
+            self.close()
+            raise
+
+    def _put(self, img):
+        data = img.convert("RGBX").tobytes()
+        shm = shared_memory.SharedMemory(create=True, size=len(data))
+        self.blocks.append(shm)
+        shm.buf[:len(data)] = data
+        return shm.name, img.size
+
+    def close(self):
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FontCache:
+    """
+    Cache font PIL theo (tên font, bold, size), bỏ bớt font ít dùng nhất (LRU)
+    khi vượt max_size vì size riêng từng trường / từng người là không giới hạn.
+    """
+    def __init__(self, max_size=64):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._fonts = OrderedDict()
+        self._lock = threading.Lock()  # GUI và thread in nền dùng chung
+
+    def get(self, font_name, is_bold, size):
+        with self._lock:
+            return self._get(font_name, is_bold, size)
+
+    def _get(self, font_name, is_bold, size):
+        key = (font_name, bool(is_bold), size)
+        font = self._fonts.get(key)
+        if font is not None:
+            self.hits += 1
+            self._fonts.move_to_end(key)
+            return font
+
+        self.misses += 1
+        with PROFILER.stage("font_load"):
+            try:
+                font = ImageFont.truetype(get_font_path(font_name, bool(is_bold)), size)
+            except:
+                font = ImageFont.load_default()
+        self._fonts[key] = font
+        if len(self._fonts) > self.max_size:
+            self._fonts.popitem(last=False)
+        return font
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._fonts)}
+
+    def clear(self):
+        self._fonts.clear()
+        self.hits = self.misses = 0
+
+
+# Dùng chung cho cả process (GUI hoặc từng worker)
+FONT_CACHE = FontCache()
+
+
+class SignatureIndex:
+    """
+    Chỉ mục tên file chữ ký (stem -> path) của 1 folder, quét 1 lần bằng os.scandir
+    thay vì os.path.exists từng file cho từng người. Tự quét lại khi mtime folder đổi
+    (kiểm tra tối đa mỗi `recheck` giây để không stat liên tục trên ổ mạng).
+    """
+    def __init__(self, recheck=1.0):
+        self.recheck = recheck
+        self.folder = None
+        self._mtime = None
+        self._checked_at = 0.0
+        self._index = {}
+
+    def set_folder(self, folder):
+        self.folder = folder
+        self._mtime = None
+        self._index = {}
+        if folder: self._refresh(force=True)
+
+    def _refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.recheck: return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.folder).st_mtime
+        except OSError:
+            self._index, self._mtime = {}, None
+            return
+        if mtime == self._mtime: return
+
+        rank = {ext: i for i, ext in enumerate(SIGNATURE_EXTS)}
+        index, best = {}, {}
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                stem, ext = os.path.splitext(entry.name)
+                ext = ext.lower()
+                if ext not in rank or not entry.is_file(): continue
+                key = stem.lower()
+                if key not in best or rank[ext] < best[key]:
+                    best[key] = rank[ext]
+                    index[key] = entry.path
+        self._index, self._mtime = index, mtime
+
+    def lookup(self, folder, names):
+        """Trả về path ảnh chữ ký đầu tiên khớp theo thứ tự names (ưu tiên .png > .jpg > .jpeg)."""
+        if folder != self.folder:
+            self.set_folder(folder)
+        else:
+            self._refresh()
+        for n in names:
+            p = self._index.get(n.lower())
+            if p: return p
+        return None
+
+    def __len__(self):
+        return len(self._index)
+
+
+class ScaledSignatureCache:
+    """
+    Cache LRU ảnh chữ ký đã decode + resize sẵn, key (path, mtime, w, h).
+    Giới hạn theo tổng số byte (RGBA = w*h*4) chứ không theo số ảnh.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(path, w, h):
+        return (path, os.path.getmtime(path), w, h)
+
+    def get(self, path, w, h):
+        with self._lock:
+            return self._get(path, w, h)
+
+    def _get(self, path, w, h):
+        key = self.key(path, w, h)
+        img = self._items.get(key)
+        if img is not None:
+            self.hits += 1
+            self._items.move_to_end(key)
+            return img
+
+        self.misses += 1
+        with PROFILER.stage("signature_load"), Image.open(path) as im:
+            img = im.convert("RGBA").resize((w, h), Image.Resampling.LANCZOS)
+        size = w * h * 4
+        if size <= self.max_bytes:
+            self._items[key] = img
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, old = self._items.popitem(last=False)
+                self.bytes -= old.width * old.height * 4
+        return img
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "items": len(self._items), "bytes": self.bytes}
+
+    def clear(self):
+        self._items.clear()
+        self.bytes = self.hits = self.misses = 0
+
+
+SIGNATURE_CACHE = ScaledSignatureCache()
+
+PROFILER.register_cache("font", FONT_CACHE.stats)
+PROFILER.register_cache("signature", SIGNATURE_CACHE.stats)
+PROFILER.register_cache("card", CARD_CACHE.stats)
+
+
+class PreviewPyramid:
+    """
+    Ảnh phôi thu nhỏ cho canvas xem trước.
+    - Pyramid kiểu mipmap: phôi gốc, 1/2, 1/4... (Image.reduce, rất nhanh) dựng 1 lần cho mỗi phôi.
+    - Mỗi kích thước hiển thị (zoom x cỡ canvas) resize từ tầng nhỏ nhất còn lớn hơn nó, rồi cache lại.
+    - fast=True (đang kéo/zoom): BILINEAR; lúc rảnh gọi lại với fast=False để có bản LANCZOS nét.
+    """
+    def __init__(self, max_items=8, min_side=256):
+        self.max_items = max_items
+        self.min_side = min_side
+        self._master = None
+        self._levels = []
+        self._items = OrderedDict()
+
+    def _build(self, master):
+        self._master = master
+        self._items.clear()
+        self._levels = [master]
+        while min(self._levels[-1].size) // 2 >= self.min_side:
+            self._levels.append(self._levels[-1].reduce(2))
+
+    def get(self, master, size, fast=False):
+        if master is not self._master:
+            self._build(master)
+
+        for key in ((size, False), (size, True)) if fast else ((size, False),):
+            img = self._items.get(key)
+            if img is not None:
+                self._items.move_to_end(key)
+                return img
+
+        src = self._levels[0]
+        for level in self._levels:
+            if level.width >= size[0] and level.height >= size[1]:
+                src = level
+        img = src.resize(size, Image.Resampling.BILINEAR if fast else Image.Resampling.LANCZOS)
+        self._items[(size, fast)] = img
+        if len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+        return img
+
+    def has_sharp(self, size):
+        return (size, False) in self._items
+
+
+# ========================================================================================
+# RENDER MANIFEST
+# ========================================================================================
+class RenderManifest:
+    """
+    manifest.json trong thư mục xuất: dòng -> {"hash": card_digest, "path": file đã render}.
+    Chạy lại chỉ render dòng đã sửa / lỗi / mất file. Ghi định kỳ (flush_every) nên bị ngắt giữa chừng
+    vẫn giữ được phần đã xong.
+    """
+    FILE = "manifest.json"
+
+    def __init__(self, output_dir, flush_every=200):
+        self.path = os.path.join(output_dir, self.FILE)
+        self.flush_every = flush_every
+        self._pending = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def is_current(self, idx, digest):
+        entry = self.entries.get(str(idx))
+        return bool(entry and digest and entry["hash"] == digest and os.path.exists(entry["path"]))
+
+    def path_of(self, idx):
+        entry = self.entries.get(str(idx))
+        return entry["path"] if entry else None
+
+    def record(self, idx, digest, path):
+        if path: self.entries[str(idx)] = {"hash": digest, "path": path}
+        else: self.entries.pop(str(idx), None)
+        self._pending += 1
+        if self._pending >= self.flush_every: self.flush()
+
+    def flush(self):
+        if not self._pending: return
+        atomic_write_text(self.path, json.dumps(self.entries, ensure_ascii=False))
+        self._pending = 0
+
+
+# ========================================================================================
+# RENDER ENGINE
+# ========================================================================================
+class RenderEngine:
+    """
+    Giữ dữ liệu (DataFrame, phôi, cấu hình) và render từng thẻ ra ảnh PIL.
+    Không phụ thuộc giao diện nên chạy được trên server Linux không có màn hình.
+    """
+    def __init__(self, config_path=CONFIG_FILE):
+        self.config_path = config_path
+        self.df = None
+        self.sheet_path = None
+        self.sheet_columns = []
+        self.template_path = None
+        self.signature_folder = None
+        self.global_config = {}
+        self.custom_configs = {}
+        self.template_cache = TemplateCache()
+        self.card_cache = CARD_CACHE
+        self.config_writer = ConfigWriter(self)
+        self.signature_index = SignatureIndex()
+        self._column_index = None
+        self._display_df = None
+        self._display = {}
+        self.static_fields = frozenset()  # trường đã vẽ sẵn trên lớp nền (xem static_layer)
+        self._static_layers = {}
+        self.invalidate_layout()
+
+    # ----------------------------------------------------------------
+    # DATA & CONFIG
+    # ----------------------------------------------------------------
+    def load_config_file(self):
+        self.global_config, self.custom_configs = load_config(self.config_path)
+        self.invalidate_layout()
+
+    def schedule_config_save(self, idx=None):
+        """Đánh dấu cấu hình đã đổi; ConfigWriter sẽ gom lại và ghi sau."""
+        self.config_writer.mark_dirty(idx)
+
+    def load_excel(self, path, usecols=None):
+        """
+        Nạp danh sách (Excel/CSV/Parquet) qua SHEET_CACHE, chỉ lấy các cột cần:
+        trường đang bật + cột vai trò (tên, giới tính, CCCD, khu vực). sheet_columns giữ đủ tên cột.
+        """
+        self.sheet_path = path
+        self.sheet_columns = SHEET_CACHE.columns(path)
+        if usecols is None:
+            usecols = self.needed_columns()
+        with PROFILER.stage("sheet_load"):
+            self.df = SHEET_CACHE.load(path, usecols).fillna("")
+        self.preformat()
+        return self.df
+
+    def needed_columns(self):
+        cols = self.sheet_columns
+        needed = {c for c in cols if self.global_config.get(c, {}).get("enable", False)}
+        for props in self.custom_configs.values():
+            needed.update(c for c, p in props.items() if c in cols and p.get("enable", False))
+        needed.update(self.role_column(role) for role in ROLE_KEYWORDS)
+        return [c for c in cols if c in needed]
+
+    def ensure_columns(self, columns):
+        """Nạp thêm cột (vd: vừa bật 1 trường chưa có trong df) từ cache dạng cột."""
+        if self.df is None or not self.sheet_path: return
+        missing = [c for c in columns if c in self.sheet_columns and c not in self.df.columns]
+        if not missing: return
+        extra = SHEET_CACHE.load(self.sheet_path, missing).fillna("")
+        df = pd.concat([self.df, extra], axis=1)
+        self.df = df[[c for c in self.sheet_columns if c in df.columns]]
+        self.preformat()
+
+    def preformat(self, columns=None):
+        """Chuyển trước cả cột sang chuỗi hiển thị (vector hóa) - lúc vẽ chỉ còn tra bảng."""
+        if self._display_df is not self.df:
+            self._display, self._display_df = {}, self.df
+        if self.df is None: return
+        for col in (self.df.columns if columns is None else columns):
+            if col in self.df.columns and col not in self._display:
+                with PROFILER.stage("preformat"):
+                    self._display[col] = preformat_series(self.df[col])
+
+    def display_column(self, col, upper=False):
+        """List chuỗi hiển thị của cả cột (None nếu không có cột); bản viết hoa dựng khi cần."""
+        if self._display_df is not self.df or col not in self._display:
+            self.preformat([col])
+        values = self._display.get(col)
+        if values is None or not upper: return values
+        key = (col, "upper")
+        if key not in self._display:
+            self._display[key] = [v.upper() for v in values]
+        return self._display[key]
+
+    def display_value(self, idx, col, upper=False):
+        """Chuỗi hiển thị của ô (idx, col); "" nếu không có cột."""
+        values = self.display_column(col, upper)
+        return values[idx] if values is not None else ""
+
+    def set_signature_folder(self, folder):
+        self.signature_folder = folder
+        self.signature_index.set_folder(folder)
+
+    @property
+    def column_index(self):
+        """ColumnIndex của bộ tiêu đề hiện tại (sheet_columns, hoặc df.columns nếu df gán trực tiếp)."""
+        cols = self.sheet_columns or (list(self.df.columns) if self.df is not None else [])
+        if self._column_index is None or self._column_index.columns != cols:
+            self._column_index = ColumnIndex(cols, ROLE_KEYWORDS)
+        return self._column_index
+
+    def role_column(self, role):
+        """Tên cột cho vai trò trong ROLE_KEYWORDS; không thấy cột tên thì lấy cột thứ 2 như trước."""
+        index = self.column_index
+        col = index.role(role)
+        if col is None and role == "name" and len(index.columns) > 1:
+            col = index.columns[1]
+        return col
+
+    def _cccd_column(self):
+        return self.role_column("cccd")
+
+    # ----------------------------------------------------------------
+    # LAYOUT PLAN (thay cho deepcopy cấu hình mỗi lần vẽ)
+    # ----------------------------------------------------------------
+    def invalidate_layout(self, idx=None):
+        """Gọi sau khi sửa cấu hình. idx: chỉ sửa riêng 1 người -> chỉ bỏ plan của dòng đó."""
+        if idx is None:
+            self._field_specs = None
+            self._global_layout = None
+            self._row_layouts = {}
+        else:
+            self._row_layouts.pop(idx, None)
+
+    def _compiled_fields(self):
+        if self._field_specs is None:
+            self._field_specs = OrderedDict(
+                (col, compile_field(col, cfg)) for col, cfg in self.global_config.items())
+            self._global_layout = tuple(s for s in self._field_specs.values() if s.enable)
+        return self._field_specs
+
+    def get_layout(self, idx):
+        """Danh sách (tuple) FieldSpec đang bật cho dòng idx, đã áp chỉnh riêng nếu có."""
+        fields = self._compiled_fields()
+        delta = self.custom_configs.get(idx)
+        if not delta:
+            return self._global_layout
+
+        layout = self._row_layouts.get(idx)
+        if layout is None:
+            specs = [compile_field(col, {**self.global_config[col], **delta[col]}) if col in delta else spec
+                     for col, spec in fields.items()]
+            specs.extend(compile_field(col, props) for col, props in delta.items() if col not in fields)
+            layout = self._row_layouts[idx] = tuple(s for s in specs if s.enable)
+        return layout
+
+    def get_field_config(self, idx, col):
+        """Cấu hình đã gộp của 1 trường (kể cả trường đang tắt) - không deepcopy cả bảng."""
+        cfg = dict(self.global_config.get(col, {}))
+        cfg.update(self.custom_configs.get(idx, {}).get(col, {}))
+        return cfg
+
+    # ----------------------------------------------------------------
+    # RENDERING
+    # ----------------------------------------------------------------
+    def set_template(self, path):
+        self.template_path = path
+        self.template_cache.invalidate()
+        self._static_layers = {}
+
+    def _open_template(self, scale=1.0):
+        return self.template_cache.get(self.template_path, scale)
+
+    def _load_font(self, font_name, is_bold, size):
+        return FONT_CACHE.get(font_name, is_bold, size)
+
+    def render_one_image(self, idx, scale=1.0):
+        """
+        scale != 1: render thẳng ở kích thước đích (vd: ô N-up theo DPI máy in) -
+        phôi, toạ độ, cỡ chữ, chữ ký đều scale trước khi vẽ, không resample ảnh kết quả.
+        Không qua CardCache: encode + ghi PNG cho từng ô tốn hơn vẽ lại (chỉ cache JPEG 1 thẻ/trang).
+        """
+        if not self.template_path: return None
+        return self._draw_card(idx, scale)
+
+    def _draw_card(self, idx, scale=1.0):
+        stage = PROFILER.stage
+        PROFILER.count("cards")
+        with stage("card"):
+            with stage("layout"):
+                layout = self.get_layout(idx)
+            with stage("template"):
+                if self.static_fields:
+                    img = self._static_base(idx, layout, scale)
+                    layout = [s for s in layout if s.name not in self.static_fields]
+                else:
+                    img = self._open_template(scale)
+            self._draw_fields(img, idx, layout, scale)
+        return img
+
+    def _draw_fields(self, img, idx, layout, scale=1.0):
+        stage = PROFILER.stage
+        draw = ImageDraw.Draw(img)
+        for spec in layout:
+            x, y = spec.x * scale, spec.y * scale
+            if spec.kind == "image":
+                w, h = max(1, round(spec.w * scale)), max(1, round(spec.h * scale))
+                with stage("signature"):
+                    sig = self.get_scaled_signature(idx, w, h)
+                if sig:
+                    with stage("paste"):
+                        img.paste(sig, (int(x - w/2), int(y - h/2)), sig)
+            else:
+                val = self.display_value(idx, spec.name, spec.upper)
+                with stage("font"):
+                    font = self._load_font(spec.font, spec.bold, max(1, round(spec.size * scale)))
+                with stage("text_draw"):
+                    draw.text((x, y), val, font=font, fill=spec.color, anchor="mm")
+
+    # ----------------------------------------------------------------
+    # STATIC LAYER
+    # ----------------------------------------------------------------
+    def analyze_static(self, indices):
+        """
+        Tên các trường giống hệt nhau trên mọi dòng trong indices: cùng FieldSpec đã resolve
+        và cùng giá trị (chữ ký: cùng file) - vd: tên đơn vị, ngày ký, người ký, chữ ký chung.
+        """
+        indices = list(indices)
+        if len(indices) < 2 or not self.template_path: return frozenset()
+        with PROFILER.stage("static_analyze"):
+            self._compiled_fields()
+            specs = {s.name: s for s in self._global_layout}
+            for idx in indices:
+                if not self.custom_configs.get(idx): continue
+                row = {s.name: s for s in self.get_layout(idx)}
+                specs = {name: spec for name, spec in specs.items() if row.get(name) == spec}
+
+            static = []
+            for name, spec in specs.items():
+                if spec.kind == "image":
+                    values = (self.get_signature_path(idx) for idx in indices)
+                else:
+                    col = self.display_column(name, spec.upper)
+                    values = (col[idx] for idx in indices) if col is not None else iter(())
+                first = next(values, None)
+                if all(v == first for v in values): static.append(name)
+            return frozenset(static)
+
+    @contextmanager
+    def static_layer(self, indices, scale=1.0):
+        """
+        Trong khối with: các trường không đổi trên indices được vẽ 1 lần lên lớp nền (phôi + trường tĩnh)
+        ở scale, mỗi thẻ chỉ copy lớp nền rồi vẽ các trường thay đổi. Ra khỏi khối thì bỏ lớp nền.
+        """
+        if self.static_fields:  # đã nằm trong static_layer của cả đợt (print_batch) -> dùng luôn
+            yield self.static_fields
+            return
+        indices = list(indices)
+        self.static_fields = self.analyze_static(indices)
+        try:
+            if self.static_fields:
+                self._static_base(indices[0], self.get_layout(indices[0]), scale)
+            yield self.static_fields
+        finally:
+            self.static_fields = frozenset()
+            self._static_layers = {}
+
+    def _static_base(self, idx, layout, scale=1.0):
+        """Bản copy của lớp nền (phôi + các trường trong static_fields) cho thẻ idx."""
+        static = [s for s in layout if s.name in self.static_fields]
+        key = (self.template_path, scale, tuple((tuple(s), self._field_value(idx, s)) for s in static))
+        base = self._static_layers.get(key)
+        if base is None:
+            base = self._open_template(scale)
+            self._draw_fields(base, idx, static, scale)
+            if len(self._static_layers) >= 8: self._static_layers = {}
+            self._static_layers[key] = base
+        return base.copy() if base.mode == "RGB" else base.convert("RGB")
+
+    def _field_value(self, idx, spec):
+        if spec.kind == "image": return self.get_signature_path(idx)
+        return self.display_value(idx, spec.name, spec.upper)
+
+    def render_sheet(self, group, layout):
+        """Render 1 tờ N-up gồm các dòng trong group (tối đa layout.per_sheet)."""
+        scale = layout.card_scale(self.template_cache.master(self.template_path).size)
+        imposer = SheetImposer(layout)
+        return imposer.compose(self.render_one_image(idx, scale) for idx in group)
+
+    def get_signature_path(self, idx):
+        with PROFILER.stage("signature_lookup"):
+            return self._signature_path(idx)
+
+    def _signature_path(self, idx):
+        if idx in self.custom_configs and "signature_img" in self.custom_configs[idx]:
+            p = self.custom_configs[idx]["signature_img"].get("path")
+            if p and os.path.exists(p): return p
+
+        if self.signature_folder:
+            col = self._cccd_column()
+            cccd = self.display_value(idx, col).strip() if col else ""
+            names = [cccd, str(idx+1)] if cccd else [str(idx+1)]
+            return self.signature_index.lookup(self.signature_folder, names)
+        return None
+
+    def get_scaled_signature(self, idx, w, h):
+        """Chữ ký đã resize (w, h), lấy từ SIGNATURE_CACHE. Không được sửa ảnh trả về."""
+        p = self.get_signature_path(idx)
+        return SIGNATURE_CACHE.get(p, w, h) if p else None
+
+    def card_digest(self, idx):
+        """sha1 của mọi thứ quyết định hình thẻ: phôi, layout đã resolve, giá trị các trường, chữ ký."""
+        if not self.template_path: return None
+        h = hashlib.sha1(repr((os.path.abspath(self.template_path),
+                               os.path.getmtime(self.template_path))).encode("utf-8"))
+        for spec in self.get_layout(idx):
+            if spec.kind == "image":
+                p = self.get_signature_path(idx)
+                value = (p, os.path.getmtime(p)) if p else None
+            else:
+                value = self.display_value(idx, spec.name, spec.upper)
+            h.update(repr((tuple(spec), value)).encode("utf-8"))
+        return h.hexdigest()
+
+    def card_key(self, idx, scale, fmt):
+        """Tên file trong CardCache: card_digest + scale + định dạng (None khi cache tắt)."""
+        if not self.card_cache.max_bytes: return None
+        digest = self.card_digest(idx)
+        return f"{digest}_{scale!r}.{fmt}" if digest else None
+
+    def save_card(self, idx, output_dir):
+        img = self.render_one_image(idx)
+        if img is None: return None
+        fn = os.path.join(output_dir, f"job_{idx}.pdf")
+        with PROFILER.stage("encode"):
+            img.save(fn)
+        return fn
+
+    def render_to_files(self, indices, output_dir="temp_batch_final", progress=None, workers=1, force=False):
+        """
+        Render danh sách thẻ ra file PDF, trả về list đường dẫn theo đúng thứ tự.
+        workers > 1: chia các dòng cho nhiều process (mỗi process nạp phôi và font 1 lần).
+        Dòng có card_digest trùng manifest và còn file thì bỏ qua (force=True: render lại tất cả).
+        """
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        indices = list(indices)
+        total = len(indices)
+        manifest = RenderManifest(output_dir)
+        digests = {idx: self.card_digest(idx) for idx in indices}
+        todo = [idx for idx in indices if force or not manifest.is_current(idx, digests[idx])]
+        skipped = total - len(todo)
+        try:
+            with self.batch_pool(todo, workers) as pool:
+                if pool is not None:
+                    chunksize = max(1, len(todo) // (workers * 4))
+                    results = pool.map(_render_worker, todo, [output_dir] * len(todo), chunksize=chunksize)
+                    self._collect(zip(todo, merge_profiles(results)), manifest, digests, skipped, total, progress)
+                else:
+                    results = ((idx, self.save_card(idx, output_dir)) for idx in todo)
+                    self._collect(results, manifest, digests, skipped, total, progress)
+        finally:
+            manifest.flush()
+        return [p for p in map(manifest.path_of, indices) if p]
+
+    def render_to_pdf(self, indices, output_path, progress=None, workers=1, layout=None, vector=False, pool=None):
+        """
+        Render tất cả thẻ vào 1 file PDF nhiều trang (đúng thứ tự indices), trả về số trang.
+        layout (ImpositionLayout): xếp nhiều thẻ/tờ; None = mỗi thẻ 1 trang.
+        Trang được ghi ngay khi xong nên bộ nhớ không tăng theo số thẻ.
+        vector=True: chữ dạng vector, phôi dùng chung (render_to_vector_pdf).
+        pool: pool của batch_pool() dùng chung cho nhiều file (print_batch); None = tự tạo.
+        """
+        if vector:
+            return self.render_to_vector_pdf(indices, output_path, progress, layout)
+        out_dir = os.path.dirname(output_path)
+        if out_dir and not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+
+        indices = list(indices)
+        total = len(indices)
+        per_page = layout.per_sheet if layout else 1
+        units = [indices[i:i + per_page] for i in range(0, total, per_page)]
+
+        batch = nullcontext(pool) if pool is not None else self.batch_pool(indices, workers, layout)
+        with PdfBatchWriter(output_path) as pdf, batch as pool:
+            if pool is not None:
+                chunksize = max(1, len(units) // (workers * 4))
+                # Process con render + encode JPEG, process chính chỉ ghi bytes
+                pages = merge_profiles(pool.map(_encode_worker, units, [layout] * len(units), chunksize=chunksize))
+                try:
+                    self._write_pages(pdf, pages, units, total, progress)
+                except BaseException:  # progress() báo hủy -> bỏ các trang chưa render
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    raise
+            else:
+                pages = (self.encode_page(unit, layout) for unit in units)
+                self._write_pages(pdf, pages, units, total, progress)
+            return pdf.page_count
+
+    def render_to_vector_pdf(self, indices, output_path, progress=None, layout=None):
+        """
+        Như render_to_pdf nhưng không raster hóa: phôi nhúng 1 lần (JPEG gốc giữ nguyên bytes),
+        chữ ký nhúng 1 lần mỗi file, các trường chữ ghi dạng vector bằng font subset.
+        Chỉ chạy trong process chính - mỗi thẻ chỉ còn vài toán tử PDF, không cần chia process.
+        """
+        out_dir = os.path.dirname(output_path)
+        if out_dir and not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+
+        indices = list(indices)
+        total = len(indices)
+        per_page = layout.per_sheet if layout else 1
+        master = self.template_cache.master(self.template_path)
+        with VectorPdfWriter(output_path) as pdf:
+            tpl = pdf.image(("template", os.path.abspath(self.template_path)), master, source=self.template_path)
+            for start in range(0, total, per_page):
+                group = indices[start:start + per_page]
+                with PROFILER.stage("page"):
+                    if layout is None:
+                        dpi = master.info.get("dpi", (72, 72))[0] or 72
+                        page = pdf.new_page(master.width, master.height, dpi)
+                        self._vector_card(pdf, page, tpl, group[0])
+                    else:
+                        page = pdf.new_page(*layout.sheet_px, layout.dpi)
+                        scale = layout.card_scale(master.size)
+                        w, h = round(master.width * scale), round(master.height * scale)
+                        for i, idx in enumerate(group):
+                            x, y = layout.card_origin(i, w, h)
+                            self._vector_card(pdf, page, tpl, idx, scale, x, y)
+                            if layout.cut_marks:
+                                lines, width = layout.cut_mark_lines(x, y, x + w, y + h)
+                                for (x1, y1), (x2, y2) in lines:
+                                    page.line(x1, y1, x2, y2, width)
+                with PROFILER.stage("pdf_write"):
+                    pdf.add_vector_page(page)
+                if progress: progress(start + len(group), total)
+            return pdf.page_count
+
+    def _vector_card(self, pdf, page, tpl, idx, scale=1.0, ox=0, oy=0):
+        """Ghi 1 thẻ lên trang vector, cùng toạ độ / cỡ chữ / chữ ký như _draw_card."""
+        stage = PROFILER.stage
+        PROFILER.count("cards")
+        with stage("card"):
+            master = self.template_cache.master(self.template_path)
+            page.image(tpl, ox, oy, master.width * scale, master.height * scale)
+            with stage("layout"):
+                layout = self.get_layout(idx)
+
+            for spec in layout:
+                x, y = ox + spec.x * scale, oy + spec.y * scale
+                if spec.kind == "image":
+                    w, h = max(1, round(spec.w * scale)), max(1, round(spec.h * scale))
+                    with stage("signature"):
+                        p = self.get_signature_path(idx)
+                        sig = SIGNATURE_CACHE.get(p, w, h) if p else None
+                        if sig:
+                            xobj = pdf.image(("signature", p, w, h), sig)
+                    if sig:
+                        page.image(xobj, int(x - w/2), int(y - h/2), sig.width, sig.height)
+                else:
+                    val = self.display_value(idx, spec.name, spec.upper)
+                    with stage("font"):
+                        font = pdf.font(get_vector_font_path(spec.font, spec.bold))
+                    with stage("text_draw"):
+                        page.text(font, max(1, round(spec.size * scale)), x, y, val, ImageColor.getrgb(spec.color))
+
+    def encode_page(self, group, layout=None):
+        if layout is None:
+            return self.encode_card(group[0])
+        with PROFILER.stage("page"):
+            img = self.render_sheet(group, layout)
+        if img is None: return None
+        with PROFILER.stage("encode"):
+            return encode_jpeg(img)
+
+    def encode_card(self, idx):
+        """1 thẻ = 1 trang JPEG. JPEG được cache luôn nên thẻ không đổi không phải vẽ lẫn encode lại."""
+        if not self.template_path: return None
+        with PROFILER.stage("card_cache"):
+            key = self.card_key(idx, 1.0, "jpg")
+            data = self.card_cache.get(key) if key else None
+            if data is not None:
+                return jpeg_page(data)
+        img = self._draw_card(idx)
+        with PROFILER.stage("encode"):
+            page = encode_jpeg(img)
+        if key:
+            with PROFILER.stage("card_cache"):
+                self.card_cache.put(key, page[0])
+        return page
+
+    @staticmethod
+    def _write_pages(pdf, pages, units, total, progress):
+        done = 0
+        for unit, page in zip(units, pages):
+            if page:
+                with PROFILER.stage("pdf_write"):
+                    pdf.add_jpeg(*page)
+            done += len(unit)
+            if progress: progress(done, total)
+
+    @staticmethod
+    def _collect(results, manifest, digests, skipped, total, progress):
+        if progress and skipped: progress(skipped, total)
+        for n, (idx, fn) in enumerate(results, skipped + 1):
+            manifest.record(idx, digests[idx], fn)
+            if progress: progress(n, total)
+
+    @contextmanager
+    def batch_pool(self, indices, workers=1, layout=None):
+        """
+        Chuẩn bị 1 đợt render indices: lớp nền trường tĩnh (static_layer) và, nếu workers > 1,
+        pool process con dựng lại engine từ worker_state(). Trả về pool (None = render ngay trong
+        process này). print_batch giữ 1 pool cho cả đợt in thay vì mỗi file 1 pool.
+        - Process con start bằng "spawn": fork từ thread nền trong khi thread GUI đang giữ lock
+          (SIGNATURE_CACHE, PROFILER...) thì process con bị treo ở lock đó.
+        - Phôi (kể cả bản scale cho N-up) và lớp nền được đặt 1 lần trong shared memory nên bộ nhớ
+          không tăng theo số process; không tạo được shared memory thì mỗi process tự decode phôi.
+        """
+        indices = list(indices)
+        master = self.template_cache.master(self.template_path) if self.template_path else None
+        scale = layout.card_scale(master.size) if layout and master else 1.0
+        units = -(-len(indices) // (layout.per_sheet if layout else 1))
+        with self.static_layer(indices, scale):
+            if min(workers, units) <= 1:
+                yield None
+                return
+            shared = None
+            if master is not None:
+                try:
+                    shared = self.template_cache.share(self.template_path, [scale], self._static_layers)
+                except OSError:
+                    shared = None
+            try:
+                with ProcessPoolExecutor(max_workers=min(workers, units), mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=_init_worker,
+                                         initargs=(self.worker_state(), PROFILER.enabled,
+                                                   shared.handle if shared else None)) as pool:
+                    yield pool
+            finally:
+                if shared: shared.close()
+
+    def worker_state(self):
+        """Dữ liệu tối thiểu (picklable) để dựng lại engine trong process con."""
+        return {
+            "config_path": self.config_path,
+            "df": self.df,
+            "sheet_path": self.sheet_path,
+            "sheet_columns": self.sheet_columns,
+            "template_path": self.template_path,
+            "signature_folder": self.signature_folder,
+            "global_config": self.global_config,
+            "custom_configs": self.custom_configs,
+            "card_cache": self.card_cache,
+            "static_fields": self.static_fields,
+            # Chuỗi hiển thị đã chuẩn hóa lúc nạp sheet -> process con không phải preformat lại
+            "_display": self._display if self._display_df is self.df else {},
+        }
+
+
+    def job_source(self):
+        """Định danh dữ liệu của 1 đợt in - đợt in dở (JobState) chỉ chạy tiếp khi khớp."""
+        return {
+            "sheet": os.path.abspath(self.sheet_path) if self.sheet_path else None,
+            "template": os.path.abspath(self.template_path) if self.template_path else None,
+            "rows": len(self.df) if self.df is not None else 0,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        engine = RenderEngine(state["config_path"])
+        for k, v in state.items():
+            setattr(engine, k, v)
+        if engine._display: engine._display_df = engine.df
+        engine.invalidate_layout()
+        return engine
+
+    def snapshot(self):
+        """Bản sao độc lập (cấu hình deepcopy) để render ở thread nền trong khi GUI vẫn sửa tiếp."""
+        state = self.worker_state()
+        state["global_config"] = deepcopy(self.global_config)
+        state["custom_configs"] = deepcopy(self.custom_configs)
+        state["_display"] = dict(state["_display"])  # GUI vẫn thêm cột vào bảng của mình
+        return RenderEngine.from_state(state)
+
+
+_worker_engine = None
+
+
+def _init_worker(state, profile=False, template=None):
+    global _worker_engine
+    # Engine trong process con: phôi (TemplateCache) và font (FONT_CACHE) nạp 1 lần cho cả process,
+    # phôi lấy thẳng từ shared memory của process chính nếu có (template = SharedTemplate.handle)
+    _worker_engine = RenderEngine.from_state(state)
+    if template: _worker_engine._static_layers.update(_worker_engine.template_cache.attach(template))
+    if profile:
+        # Pool chạy kiểu spawn: PROFILER / FONT_CACHE / SIGNATURE_CACHE trong process con bắt đầu từ 0
+        PROFILER.enable()
+        PROFILER.register_cache("card", _worker_engine.card_cache.stats)
+
+
+# Kết quả từ process con đi kèm số liệu PROFILER (None khi tắt) -> merge_profiles() gộp về process chính
+def _render_worker(idx, output_dir):
+    return _worker_engine.save_card(idx, output_dir), PROFILER.take()
+
+
+def _encode_worker(group, layout):
+    return _worker_engine.encode_page(group, layout), PROFILER.take()
+
+
+def merge_profiles(results):
+    for result, profile in results:
+        PROFILER.merge(profile)
+        yield result
+
+
+# ========================================================================================
+# COMMAND LINE
+# ========================================================================================
+def parse_indices(spec, total):
+    """'1-10,15' (STT bắt đầu từ 1) -> [0..9, 14]. Rỗng = tất cả."""
+    if not spec:
+        return list(range(total))
+    out = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part: continue
+        if "-" in part:
+            a, b = part.split("-", 1)
+            out.extend(range(int(a) - 1, min(int(b), total)))
+        else:
+            out.append(int(part) - 1)
+    return [i for i in out if 0 <= i < total]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render thẻ cử tri không cần giao diện.")
+    parser.add_argument("--excel", required=True, help="File danh sách cử tri (.xlsx/.xls/.csv/.parquet)")
+    parser.add_argument("--template", required=True, help="Ảnh phôi (.jpg/.png)")
+    parser.add_argument("--config", default=CONFIG_FILE, help="File cấu hình vị trí trường")
+    parser.add_argument("--signatures", default=None, help="Folder ảnh chữ ký")
+    parser.add_argument("--out", default="temp_batch_final", help="Thư mục xuất file")
+    parser.add_argument("--split", action="store_true", help="Mỗi thẻ 1 file PDF riêng (mặc định: gộp 1 file)")
+    parser.add_argument("--force", action="store_true",
+                        help="Với --split: render lại cả thẻ chưa đổi (mặc định bỏ qua theo manifest.json)")
+    parser.add_argument("--vector", action="store_true",
+                        help="PDF chữ vector: phôi nhúng 1 lần, chữ dùng font subset (file nhỏ, render nhanh)")
+    parser.add_argument("--nup", default=None, help="Xếp nhiều thẻ/tờ theo lưới cột x hàng, vd: 2x2")
+    parser.add_argument("--sheet", default="A4", help="Khổ giấy khi dùng --nup (A3/A4/A5)")
+    parser.add_argument("--dpi", type=int, default=300, help="DPI máy in khi dùng --nup")
+    parser.add_argument("--margin", type=float, default=8, help="Lề tờ giấy (mm) khi dùng --nup")
+    parser.add_argument("--no-cut-marks", action="store_true", help="Không vẽ dấu cắt")
+    parser.add_argument("--print", dest="backend", choices=sorted(BACKENDS), default=None,
+                        help="Gửi lệnh in sau khi render: shell (Windows), lp (CUPS), file (chạy thử)")
+    parser.add_argument("--printer", default=None, help="Tên máy in cho backend lp")
+    parser.add_argument("--chunk", type=int, default=500, help="Số thẻ mỗi lệnh in khi dùng --print")
+    parser.add_argument("--resume", action="store_true", help="Chạy tiếp đợt in dở (job_state.json trong --out)")
+    parser.add_argument("--rows", default="", help="STT cần in, vd: 1-100,205 (mặc định: tất cả)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Số process render song song")
+    parser.add_argument("--card-cache-mb", type=int, default=CARD_CACHE.max_bytes // (1024 * 1024),
+                        help="Dung lượng cache thẻ đã render (.cache/cards), 0 = tắt")
+    parser.add_argument("--profile", nargs="?", const="", default=None, metavar="JSONL",
+                        help="Đo thời gian từng bước, in bảng tổng kết (kèm file JSON lines nếu có đường dẫn)")
+    args = parser.parse_args(argv)
+
+    if args.profile is not None:
+        PROFILER.enable(args.profile or None)
+    try:
+        with PROFILER.stage("batch"):
+            return run_cli(args)
+    finally:
+        if PROFILER.enabled:
+            print(PROFILER.summary(), file=sys.stderr)
+            PROFILER.export_jsonl()
+
+
+def run_cli(args):
+    CARD_CACHE.max_bytes = args.card_cache_mb * 1024 * 1024
+    engine = RenderEngine(config_path=args.config)
+    engine.load_config_file()
+    engine.load_excel(args.excel)
+    engine.set_template(args.template)
+    engine.set_signature_folder(args.signatures)
+
+    indices = parse_indices(args.rows, len(engine.df))
+
+    def progress(n, total):
+        print(f"\r{n}/{total}", end="", file=sys.stderr, flush=True)
+
+    layout = None
+    if args.nup:
+        layout = ImpositionLayout.parse(args.nup, sheet=args.sheet, dpi=args.dpi,
+                                        margin_mm=args.margin, cut_marks=not args.no_cut_marks)
+
+    if args.backend:
+        if args.backend == "lp":
+            backend = LpBackend(args.printer)
+        elif args.backend == "file":
+            backend = FileSinkBackend(folder=os.path.join(args.out, "spool"))
+        else:
+            backend = BACKENDS[args.backend]()
+        spooler = PrintSpooler(backend)
+
+        def on_event(kind, data):
+            if kind == "rendered":
+                eta = f" ~{data['eta']:.0f}s" if data["eta"] is not None else ""
+                print(f"\r{data['done']}/{data['total']} ({data['rate']:.1f} thẻ/s{eta})   ",
+                      end="", file=sys.stderr, flush=True)
+            elif kind in ("spooled", "failed", "retry", "cancelled", "render_error"):
+                print(f"\n[{kind}] {data}", file=sys.stderr)
+
+        state_path = os.path.join(args.out, JOB_STATE_FILE)
+        job = JobState.load(state_path) if args.resume else None
+        if job is not None and not job.matches(engine.job_source()):
+            print("job_state.json không khớp danh sách/phôi hiện tại -> in mới", file=sys.stderr)
+            job = None
+        if job is None:
+            job = JobState.new(state_path, indices, args.chunk, layout, source=engine.job_source(),
+                               vector=args.vector)
+            job.save()
+
+        cancel = threading.Event()
+        worker = start_print_thread(engine, job.indices, spooler, output_dir=args.out,
+                                    workers=args.workers, cancel=cancel, job=job)
+        try:
+            while worker.is_alive() or spooler.is_alive():
+                spooler.drain_events(on_event)
+                time.sleep(0.2)
+        except KeyboardInterrupt:
+            cancel.set()
+            spooler.drop_pending()
+            worker.join()
+            spooler.close()
+            print("\nĐã dừng - chạy lại với --resume để in tiếp", file=sys.stderr)
+        spooler.drain_events(on_event)
+        print(f"Đã gửi in {spooler.spooled} file, lỗi {spooler.failed}")
+        return 1 if spooler.failed else 0
+
+    if args.split:
+        files = engine.render_to_files(indices, args.out, progress=progress, workers=args.workers,
+                                       force=args.force)
+        print(file=sys.stderr)
+        print(f"{len(files)} thẻ trong {args.out} (thẻ không đổi so với manifest.json được giữ nguyên)")
+    else:
+        out = os.path.join(args.out, f"batch_{time.strftime('%Y%m%d_%H%M%S')}.pdf")
+        pages = engine.render_to_pdf(indices, out, progress=progress, workers=args.workers, layout=layout,
+                                     vector=args.vector)
+        print(file=sys.stderr)
+        print(f"Đã render {len(indices)} thẻ ({pages} trang) vào {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,320 @@
+"""
+Hàng đợi in chạy nền: tách bước render (tạo PDF) và bước gửi lệnh in,
+để thẻ của đợt sau được render trong lúc máy in đang nhận đợt trước.
+
+Tiến độ từng phần được ghi vào JobState (job_state.json) nên đợt in bị ngắt/hủy có thể chạy tiếp.
+
+Backend gửi lệnh in có thể thay thế:
+    ShellExecuteBackend  - Windows, gọi win32api.ShellExecute(..., "print", ...) như cũ
+    LpBackend            - Linux/macOS, lệnh `lp` của CUPS
+    FileSinkBackend      - chỉ copy file vào 1 folder (chạy thử trên Linux không có máy in)
+"""
+import json
+import os
+import platform
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from contextlib import nullcontext
+
+from file_utils import atomic_write_text
+from imposition import ImpositionLayout
+from profiling import PROFILER
+
+JOB_STATE_FILE = "job_state.json"
+
+
+# ========================================================================================
+# BACKENDS
+# ========================================================================================
+class ShellExecuteBackend:
+    name = "shell"
+
+    def submit(self, path):
+        import win32api  # chỉ có trên Windows (pywin32)
+        win32api.ShellExecute(0, "print", os.path.abspath(path), None, ".", 0)
+
+
+class LpBackend:
+    name = "lp"
+
+    def __init__(self, printer=None, options=()):
+        self.printer = printer
+        self.options = list(options)
+
+    def submit(self, path):
+        cmd = ["lp"]
+        if self.printer: cmd += ["-d", self.printer]
+        for opt in self.options: cmd += ["-o", opt]
+        subprocess.run(cmd + [path], check=True, capture_output=True)
+
+
+class FileSinkBackend:
+    name = "file"
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def submit(self, path):
+        os.makedirs(self.folder, exist_ok=True)
+        shutil.copy2(path, os.path.join(self.folder, os.path.basename(path)))
+
+
+BACKENDS = {"shell": ShellExecuteBackend, "lp": LpBackend, "file": FileSinkBackend}
+
+
+def default_backend(folder):
+    """Backend theo hệ điều hành; folder dùng cho FileSinkBackend khi không có máy in (thường là <out>/spool)."""
+    if platform.system() == "Windows":
+        return ShellExecuteBackend()
+    if shutil.which("lp"):
+        return LpBackend()
+    return FileSinkBackend(folder)
+
+
+# ========================================================================================
+# SPOOLER
+# ========================================================================================
+class PrintSpooler:
+    """
+    Thread nền gửi lần lượt các file trong hàng đợi tới backend.
+    - Hàng đợi có giới hạn (max_queue): submit() sẽ chờ khi máy in không theo kịp (backpressure).
+    - Lỗi thì thử lại `retries` lần, cách nhau retry_delay giây (tăng dần).
+    - Sự kiện (kind, data) được đẩy vào self.events; GUI đọc bằng drain_events() trong root.after,
+      nên callback luôn chạy trên luồng Tk.
+    """
+    def __init__(self, backend, max_queue=4, retries=3, retry_delay=2.0, on_spooled=None):
+        self.backend = backend
+        self.on_spooled = on_spooled  # gọi trên thread spooler, vd: JobState.mark_spooled
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.jobs = queue.Queue(maxsize=max_queue)
+        self.events = queue.Queue()
+        self.spooled = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._submit_loop, daemon=True)
+        self._thread.start()
+
+    def emit(self, kind, **data):
+        self.events.put((kind, data))
+
+    def submit(self, path):
+        """Đưa file vào hàng đợi in; chờ nếu hàng đợi đầy."""
+        self.jobs.put(path)
+        self.emit("queued", path=path, pending=self.jobs.qsize())
+
+    def drop_pending(self):
+        """Bỏ các file đang chờ gửi (khi hủy đợt in); file đang gửi dở vẫn gửi xong."""
+        dropped, closing = [], False
+        while True:
+            try:
+                path = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if path is None: closing = True
+            else: dropped.append(path)
+        if closing: self.jobs.put(None)
+        return dropped
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def close(self, wait=True):
+        self.jobs.put(None)
+        if wait: self._thread.join()
+
+    def _submit_loop(self):
+        while True:
+            path = self.jobs.get()
+            if path is None: break
+            for attempt in range(1, self.retries + 1):
+                try:
+                    with PROFILER.stage("spool"):
+                        self.backend.submit(path)
+                    self.spooled += 1
+                    if self.on_spooled: self.on_spooled(path)
+                    self.emit("spooled", path=path, attempt=attempt)
+                    break
+                except Exception as e:
+                    if attempt == self.retries:
+                        self.failed += 1
+                        self.emit("failed", path=path, error=str(e))
+                    else:
+                        self.emit("retry", path=path, attempt=attempt, error=str(e))
+                        time.sleep(self.retry_delay * attempt)
+        self.emit("closed", spooled=self.spooled, failed=self.failed)
+
+    def drain_events(self, handler, limit=200):
+        """Gọi handler(kind, data) cho các sự kiện đang chờ (không block)."""
+        for _ in range(limit):
+            try:
+                kind, data = self.events.get_nowait()
+            except queue.Empty:
+                return
+            handler(kind, data)
+
+
+# ========================================================================================
+# JOB STATE
+# ========================================================================================
+class BatchCancelled(Exception):
+    pass
+
+
+class JobState:
+    """
+    Trạng thái 1 đợt in: danh sách dòng, cách chia phần, layout N-up và phần nào đã render / đã gửi in.
+    Ghi lại file JSON (atomic) sau mỗi bước; path=None thì chỉ giữ trong bộ nhớ.
+    Khi mọi phần đã gửi in, file trạng thái tự xóa.
+    """
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        self._lock = threading.Lock()
+
+    @classmethod
+    def new(cls, path, indices, chunk_size=500, layout=None, prefix=None, source=None, vector=False):
+        indices = list(indices)
+        if layout:  # mỗi file phải chứa trọn số tờ
+            chunk_size = max(layout.per_sheet, chunk_size // layout.per_sheet * layout.per_sheet)
+        return cls(path, {
+            "prefix": prefix or f"batch_{time.strftime('%Y%m%d_%H%M%S')}",
+            "indices": indices,
+            "chunk_size": chunk_size or len(indices) or 1,
+            "layout": layout.to_dict() if layout else None,
+            "vector": bool(vector),
+            "source": source or {},
+            "parts": {},
+        })
+
+    @classmethod
+    def load(cls, path):
+        """JobState đang dở từ file, hoặc None nếu không có / hỏng."""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return cls(path, json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def save(self):
+        if not self.path: return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        atomic_write_text(self.path, json.dumps(self.data))
+
+    @property
+    def indices(self):
+        return self.data["indices"]
+
+    @property
+    def layout(self):
+        return ImpositionLayout.from_dict(self.data["layout"])
+
+    @property
+    def vector(self):
+        return self.data.get("vector", False)
+
+    def parts(self):
+        """[(số thứ tự phần, các dòng của phần)] - phần đánh số từ 1."""
+        size = self.data["chunk_size"]
+        return [(n, self.indices[i:i + size]) for n, i in enumerate(range(0, len(self.indices), size), 1)]
+
+    def part_path(self, output_dir, part):
+        return os.path.join(output_dir, f"{self.data['prefix']}_part{part:03d}.pdf")
+
+    def status(self, part):
+        return self.data["parts"].get(str(part))
+
+    def needs_render(self, part, output_dir):
+        """Phần chưa gửi in và chưa có file đã render (hoặc file đã mất)."""
+        status = self.status(part)
+        if status == "spooled": return False
+        return status != "rendered" or not os.path.exists(self.part_path(output_dir, part))
+
+    def cards_done(self, statuses=("spooled",)):
+        return sum(len(chunk) for part, chunk in self.parts() if self.status(part) in statuses)
+
+    def matches(self, source):
+        return self.data["source"] == source
+
+    def mark(self, part, status):
+        with self._lock:
+            self.data["parts"][str(part)] = status
+            if all(self.status(p) == "spooled" for p, _ in self.parts()):
+                self.discard()
+            else:
+                self.save()
+
+    def mark_spooled(self, path):
+        name = os.path.basename(path)
+        for part, _ in self.parts():
+            if os.path.basename(self.part_path("", part)) == name:
+                self.mark(part, "spooled")
+                return
+
+    def discard(self):
+        if self.path and os.path.exists(self.path): os.remove(self.path)
+
+
+# ========================================================================================
+# BATCH
+# ========================================================================================
+def print_batch(engine, indices, spooler, output_dir="temp_batch_final", chunk_size=500,
+                layout=None, workers=1, prefix=None, cancel=None, job=None):
+    """
+    Bước render: chia indices thành từng đợt chunk_size thẻ -> mỗi đợt 1 file PDF -> đưa vào spooler.
+    Đợt sau render trong khi spooler đang gửi đợt trước. Chạy trong thread nền (start_print_thread).
+    job (JobState): chạy tiếp đợt in dở - phần đã gửi in bỏ qua, phần đã render chỉ gửi lại.
+    cancel (threading.Event): set() để dừng giữa chừng, trạng thái job được giữ lại.
+    Sự kiện "rendered" kèm rate (thẻ/giây đo được ở lần chạy này) và eta (giây).
+    """
+    if job is None:
+        job = JobState.new(None, indices, chunk_size, layout, prefix)
+    layout = job.layout
+    total = len(job.indices)
+    spooler.on_spooled = job.mark_spooled
+
+    done = job.cards_done()
+    base, started = done, time.monotonic()
+    # Các phần còn phải render dùng chung 1 pool process con (và 1 lớp nền trường tĩnh) cho cả đợt
+    todo = [idx for part, chunk in job.parts() if job.needs_render(part, output_dir) for idx in chunk]
+    try:
+        batch = nullcontext() if job.vector or not todo else engine.batch_pool(todo, workers, layout)
+        with batch as pool:
+            for part, chunk in job.parts():
+                status = job.status(part)
+                if status == "spooled":
+                    continue
+                fn = job.part_path(output_dir, part)
+                if job.needs_render(part, output_dir):
+                    def progress(n, _total, offset=done):
+                        if cancel is not None and cancel.is_set(): raise BatchCancelled()
+                        elapsed = time.monotonic() - started
+                        rate = (offset + n - base) / elapsed if elapsed > 0 else 0.0
+                        eta = (total - offset - n) / rate if rate else None
+                        spooler.emit("rendered", done=offset + n, total=total, rate=rate, eta=eta)
+
+                    try:
+                        engine.render_to_pdf(chunk, fn, progress=progress, workers=workers, layout=layout,
+                                             vector=job.vector, pool=pool)
+                    except BatchCancelled:
+                        if os.path.exists(fn): os.remove(fn)  # file dở, lần sau render lại cả phần
+                        raise
+                    job.mark(part, "rendered")
+                done += len(chunk)
+                if cancel is not None and cancel.is_set(): raise BatchCancelled()
+                spooler.submit(fn)
+        spooler.emit("render_done", total=total)
+    except BatchCancelled:
+        spooler.emit("cancelled", done=done, total=total)
+    except Exception as e:
+        spooler.emit("render_error", done=done, error=str(e))
+    finally:
+        spooler.close(wait=False)
+
+
+def start_print_thread(engine, indices, spooler, **kwargs):
+    t = threading.Thread(target=print_batch, args=(engine, indices, spooler), kwargs=kwargs, daemon=True)
+    t.start()
+    return t
@@ -0,0 +1,98 @@
+"""
+Kiểm tra PDF chữ vector: font subset (pdf_fonts) + VectorPdfWriter đọc lại được bằng pypdf (strict)
+và copy ra đúng chữ tiếng Việt. Chạy: python -m pytest -q
+"""
+import re
+import struct
+
+import pytest
+from PIL import Image, ImageFont
+
+from pdf_fonts import PdfFont
+from pdf_output import VectorPdfWriter
+
+pypdf = pytest.importorskip("pypdf")
+
+TEXT = "Nguyễn Thị Hồng Nhung - Phường Đông Hưng Thuận"
+
+
+@pytest.fixture(scope="module")
+def font_path():
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", 10).path
+    except OSError:
+        pytest.skip("Không có font DejaVuSans.ttf")
+
+
+def _tables(data):
+    n = struct.unpack(">H", data[4:6])[0]
+    out = {}
+    for i in range(n):
+        tag, _, offset, length = struct.unpack(">4sLLL", data[12 + 16 * i:28 + 16 * i])
+        out[tag.decode("latin-1")] = data[offset:offset + length]
+    return out
+
+
+def test_subset_keeps_only_used_glyphs(font_path):
+    font = PdfFont(font_path)
+    font.encode(TEXT)
+    ttf = font.ttf
+    data = ttf.subset(font.used)
+    tables = _tables(data)
+
+    assert "cmap" not in tables and len(data) < len(ttf.data) / 4
+    offsets = struct.unpack(f">{ttf.num_glyphs + 1}L", tables["loca"])  # subset luôn ghi loca 32-bit
+    for ch in "NgyễĐ":
+        gid = ttf.cmap[ord(ch)]
+        assert offsets[gid + 1] > offsets[gid]  # glyph đã dùng còn nguyên
+    gid = ttf.cmap[ord("Z")]
+    assert offsets[gid + 1] == offsets[gid]  # glyph không dùng để rỗng
+    assert offsets[-1] == len(tables["glyf"])
+
+
+def test_vector_pdf_round_trip(tmp_path, font_path):
+    path = tmp_path / "vector.pdf"
+    template = Image.new("RGB", (400, 200), "white")
+    with VectorPdfWriter(str(path)) as pdf:
+        font = pdf.font(font_path)
+        for i in range(3):
+            page = pdf.new_page(400, 200, dpi=150)
+            page.image(pdf.image("template", template), 0, 0, 400, 200)
+            page.text(font, 18, 200, 60, TEXT, (0, 0, 255))
+            page.text(font, 14, 200, 120, f"Số CCCD: 00109001234{i}")
+            pdf.add_vector_page(page)
+
+    reader = pypdf.PdfReader(str(path), strict=True)
+    assert len(reader.pages) == 3
+    for i, page in enumerate(reader.pages):
+        text = page.extract_text()
+        assert TEXT in text
+        assert f"Số CCCD: 00109001234{i}" in text
+        assert float(page.mediabox.width) == pytest.approx(400 * 72 / 150)
+
+    # Phôi và font nhúng 1 lần, mọi trang tham chiếu cùng 1 object
+    pages = reader.pages
+    xobjects = {p["/Resources"]["/XObject"].raw_get("/Im1").idnum for p in pages}
+    fonts = {p["/Resources"]["/Font"].raw_get("/F1").idnum for p in pages}
+    assert len(xobjects) == 1 and len(fonts) == 1
+
+    type0 = pages[0]["/Resources"]["/Font"]["/F1"]
+    assert type0["/Subtype"] == "/Type0" and type0["/Encoding"] == "/Identity-H"
+    assert re.fullmatch(r"/[A-Z]{6}\+DejaVuSans", type0["/BaseFont"])  # tag subset 6 chữ hoa
+    descriptor = type0["/DescendantFonts"][0]["/FontDescriptor"]
+    embedded = descriptor["/FontFile2"].get_data()
+    with open(font_path, "rb") as f:
+        assert len(embedded) < len(f.read()) / 4
+    assert "glyf" in _tables(embedded)
+
+
+def test_text_is_centered_like_pil(font_path):
+    """Độ rộng và baseline của chữ vector khớp anchor="mm" của PIL (cùng font, cùng cỡ)."""
+    size = 40
+    font = PdfFont(font_path)
+    _, em = font.encode(TEXT)
+    pil = ImageFont.truetype(font_path, size)
+    # PIL làm tròn advance từng glyph (hinting) -> lệch tối đa ~0.5px mỗi chữ
+    assert em * size == pytest.approx(pil.getlength(TEXT), abs=0.5 * len(TEXT))
+    baseline = pil.getbbox("H", anchor="ls")[3] - pil.getbbox("H", anchor="lm")[3]
+    assert font.baseline_offset() * size == pytest.approx(-baseline, abs=1)
@@ -0,0 +1,224 @@
+"""
+Danh sách cử tri ảo cho file Excel lớn (50k+ dòng):
+Treeview chỉ chứa các dòng đang nhìn thấy (+ vài dòng đệm), lựa chọn lưu trong bitset riêng.
+"""
+import itertools
+import tkinter as tk
+from tkinter import ttk
+
+
+class SelectionSet:
+    """Bitset (bytearray) các dòng được chọn, đếm số lượng không cần duyệt lại."""
+    def __init__(self, size=0):
+        self.resize(size)
+
+    def resize(self, size):
+        self.size = size
+        self.bits = bytearray(size)
+        self.count = 0
+
+    def __contains__(self, i):
+        return 0 <= i < self.size and self.bits[i] == 1
+
+    def set_all(self, value=True):
+        self.bits = bytearray(b"\x01" * self.size) if value else bytearray(self.size)
+        self.count = self.size if value else 0
+
+    def set(self, i, value=True):
+        value = 1 if value else 0
+        if self.bits[i] != value:
+            self.bits[i] = value
+            self.count += 1 if value else -1
+
+    def toggle(self, i):
+        self.set(i, not self.bits[i])
+
+    def set_range(self, start, stop, value=True):
+        """Chọn/bỏ chọn [start, stop)."""
+        start, stop = max(0, start), min(self.size, stop)
+        if start >= stop: return
+        before = self.bits[start:stop].count(1)
+        self.bits[start:stop] = (b"\x01" if value else b"\x00") * (stop - start)
+        self.count += (stop - start - before) if value else -before
+
+    def indices(self):
+        return list(itertools.compress(range(self.size), self.bits))
+
+    def first(self):
+        i = self.bits.find(1)
+        return i if i >= 0 else None
+
+
+class VirtualVoterList(tk.Frame):
+    """
+    Thay cho Treeview đầy đủ: chỉ materialize `visible + buffer` dòng quanh vị trí cuộn.
+    Dữ liệu lấy qua callback: get_values(i) -> tuple, get_tags(i) -> tuple.
+    on_select(current) được gọi khi lựa chọn thay đổi (current = dòng vừa bấm, hoặc None).
+    """
+    def __init__(self, master, columns, on_select=None, row_height=30, buffer=10, **kwargs):
+        super().__init__(master, **kwargs)
+        self.on_select = on_select
+        self.row_height = row_height
+        self.buffer = buffer
+
+        self.total = 0
+        self.top = 0
+        self.visible = 20
+        self.cursor = None
+        self.anchor = None
+        self.selection = SelectionSet()
+        self.get_values = lambda i: ()
+        self.get_tags = lambda i: ()
+        self._shown = []
+
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(0, weight=1)
+
+        self.tree = ttk.Treeview(self, columns=[c[0] for c in columns], show="headings", selectmode="none")
+        for c_id, c_name, c_width in columns:
+            self.tree.heading(c_id, text=c_name)
+            self.tree.column(c_id, width=c_width, anchor="center" if c_id in ["stt", "gender"] else "w")
+        self.tree.tag_configure('custom', foreground='red', font=('Segoe UI', 10, 'bold'))
+        self.tree.tag_configure('picked', background='#3498db', foreground='white')
+
+        self.ysb = ttk.Scrollbar(self, orient="vertical", command=self._on_scrollbar)
+        xsb = ttk.Scrollbar(self, orient="horizontal", command=self.tree.xview)
+        self.tree.configure(xscrollcommand=xsb.set)
+
+        self.tree.grid(row=0, column=0, sticky="nsew")
+        self.ysb.grid(row=0, column=1, sticky="ns")
+        xsb.grid(row=1, column=0, sticky="ew")
+
+        self.tree.bind("<Configure>", self._on_resize)
+        self.tree.bind("<Button-1>", self._on_click)
+        self.tree.bind("<Control-Button-1>", lambda e: self._on_click(e, mode="toggle"))
+        self.tree.bind("<Shift-Button-1>", lambda e: self._on_click(e, mode="range"))
+        self.tree.bind("<MouseWheel>", self._on_wheel)
+        self.tree.bind("<Button-4>", lambda e: self.scroll_to(self.top - 3) or "break")
+        self.tree.bind("<Button-5>", lambda e: self.scroll_to(self.top + 3) or "break")
+        self.tree.bind("<Up>", lambda e: self._on_key(-1, e))
+        self.tree.bind("<Down>", lambda e: self._on_key(1, e))
+        self.tree.bind("<Prior>", lambda e: self._on_key(-self.visible, e))
+        self.tree.bind("<Next>", lambda e: self._on_key(self.visible, e))
+
+    # ----------------------------------------------------------------
+    # DATA
+    # ----------------------------------------------------------------
+    def set_source(self, total, get_values, get_tags):
+        self.total = total
+        self.get_values = get_values
+        self.get_tags = get_tags
+        self.top = 0
+        self.cursor = self.anchor = None
+        self.selection.resize(total)
+        self.refresh()
+
+    def refresh_row(self, i):
+        """Cập nhật lại 1 dòng (vd: vừa có chỉnh riêng) nếu dòng đó đang hiển thị."""
+        if self.tree.exists(i):
+            self.tree.item(i, values=self.get_values(i), tags=self._row_tags(i))
+
+    def _row_tags(self, i):
+        tags = tuple(self.get_tags(i))
+        return tags + ('picked',) if i in self.selection else tags
+
+    # ----------------------------------------------------------------
+    # VIEWPORT
+    # ----------------------------------------------------------------
+    def refresh(self):
+        """Đồng bộ các dòng được materialize với cửa sổ [top, top + visible + buffer)."""
+        self.top = max(0, min(self.top, self.total - self.visible))
+        want = list(range(self.top, min(self.total, self.top + self.visible + self.buffer)))
+
+        want_set = set(want)
+        stale = [i for i in self._shown if i not in want_set]
+        if stale:
+            self.tree.delete(*stale)
+        shown = set(self._shown) - set(stale)
+        for pos, i in enumerate(want):
+            if i in shown:
+                self.tree.move(i, "", pos)
+                self.tree.item(i, tags=self._row_tags(i))
+            else:
+                self.tree.insert("", pos, iid=i, values=self.get_values(i), tags=self._row_tags(i))
+        self._shown = want
+        self.tree.yview_moveto(0)
+
+        if self.total:
+            self.ysb.set(self.top / self.total, min(1.0, (self.top + self.visible) / self.total))
+        else:
+            self.ysb.set(0, 1)
+
+    def scroll_to(self, top):
+        top = max(0, min(top, self.total - self.visible))
+        if top != self.top:
+            self.top = top
+            self.refresh()
+
+    def see(self, i):
+        if i < self.top:
+            self.scroll_to(i)
+        elif i >= self.top + self.visible:
+            self.scroll_to(i - self.visible + 1)
+
+    def _on_resize(self, e):
+        # Trừ 1 dòng cho tiêu đề cột
+        visible = max(1, e.height // self.row_height - 1)
+        if visible != self.visible:
+            self.visible = visible
+            self.refresh()
+
+    def _on_scrollbar(self, *args):
+        if args[0] == "moveto":
+            self.scroll_to(int(float(args[1]) * self.total))
+        elif args[0] == "scroll":
+            step = self.visible if args[2] == "pages" else 1
+            self.scroll_to(self.top + int(args[1]) * step)
+
+    def _on_wheel(self, e):
+        self.scroll_to(self.top - 3 * (1 if e.delta > 0 else -1))
+        return "break"
+
+    # ----------------------------------------------------------------
+    # SELECTION
+    # ----------------------------------------------------------------
+    def _on_click(self, e, mode="single"):
+        # Tiêu đề / vạch chia cột -> để ttk xử lý (kéo đổi độ rộng cột, bấm tiêu đề)
+        if self.tree.identify_region(e.x, e.y) != "cell": return None
+        iid = self.tree.identify_row(e.y)
+        if iid == "": return None
+        self.tree.focus_set()
+        self.pick(int(iid), mode)
+        return "break"
+
+    def _on_key(self, step, e):
+        if not self.total: return "break"
+        i = max(0, min(self.total - 1, (self.cursor if self.cursor is not None else -1) + step))
+        self.pick(i, "range" if e.state & 0x0001 else "single")
+        self.see(i)
+        return "break"
+
+    def pick(self, i, mode="single"):
+        if mode == "toggle":
+            self.selection.toggle(i)
+            self.anchor = i
+        elif mode == "range" and self.anchor is not None:
+            self.selection.set_all(False)
+            self.selection.set_range(min(self.anchor, i), max(self.anchor, i) + 1)
+        else:
+            self.selection.set_all(False)
+            self.selection.set(i)
+            self.anchor = i
+        self.cursor = i
+        self.refresh()
+        if self.on_select: self.on_select(i)
+
+    def select_all(self):
+        self.selection.set_all(True)
+        self.refresh()
+        if self.on_select: self.on_select(None)
+
+    def deselect_all(self):
+        self.selection.set_all(False)
+        self.refresh()
+        if self.on_select: self.on_select(None)